@@ -0,0 +1,103 @@
+'''
+Business: Эталон общего пула соединений с Postgres для облачных функций с БД
+Args: копируется в backend/*/index.py скриптом scripts/sync_runtime.py (def и class верхнего уровня)
+Returns: TimedCursor, пул с проверкой соединений и повтор запросов на устаревшем соединении
+'''
+
+import os
+import time
+import psycopg2
+from functools import wraps
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Callable, Dict, Optional
+
+from instrumentation import log_event, timed
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_last_used: Dict[int, float] = {}
+_db_statements_run: Dict[int, bool] = {}
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            result = super().execute(query, vars)
+        _db_statements_run[id(self.connection)] = True
+        return result
+    
+    def executemany(self, query, vars_list):
+        with timed('db_query'):
+            result = super().executemany(query, vars_list)
+        _db_statements_run[id(self.connection)] = True
+        return result
+
+class StaleConnectionError(psycopg2.OperationalError):
+    pass
+
+def retry_stale_connection(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except StaleConnectionError as e:
+            log_event('db_stale_connection_retry', function=func.__name__, error=str(e))
+            return func(*args, **kwargs)
+    return wrapper
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            os.environ.get('DATABASE_URL'),
+            cursor_factory=TimedCursor,
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _db_pool
+
+def is_connection_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def release_connection(db_pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        _db_last_used.pop(id(conn), None)
+        _db_statements_run.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        _db_last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+
+def acquire_connection(db_pool: ThreadedConnectionPool):
+    for _ in range(DB_POOL_MAX):
+        conn = db_pool.getconn()
+        if is_connection_alive(conn):
+            break
+        release_connection(db_pool, conn, broken=True)
+    else:
+        conn = db_pool.getconn()
+    _db_statements_run.pop(id(conn), None)
+    return conn
@@ -0,0 +1,58 @@
+'''
+Business: Эталон построения адаптивных вариантов изображения (WebP/AVIF нескольких ширин и размытая заглушка)
+Args: копируется в backend/*/index.py скриптом scripts/sync_runtime.py (def и class верхнего уровня)
+Returns: build_image_variants
+'''
+
+import base64
+import io
+import os
+from typing import Any, Dict
+
+from storage import get_cdn_base_url, get_s3_client
+
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+VARIANTS_DIR = '_variants'
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_FORMATS = ('webp', 'avif')
+IMAGE_PLACEHOLDER_WIDTH = 16
+
+def build_image_variants(source: Any, base_key: str) -> Dict[str, Any]:
+    '''Сохраняет рядом с base_key (media/home/photo) варианты media/home/_variants/photo-640w.webp; source - файловый объект'''
+    from PIL import Image, ImageFilter, ImageOps
+    folder, _, stem = base_key.rpartition('/')
+    s3 = get_s3_client()
+    base_url = get_cdn_base_url()
+    
+    image = ImageOps.exif_transpose(Image.open(source))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    
+    variants: Dict[str, Dict[str, str]] = {}
+    for width in IMAGE_VARIANT_WIDTHS:
+        if width > image.width and width != IMAGE_VARIANT_WIDTHS[0]:
+            break
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        for fmt in IMAGE_VARIANT_FORMATS:
+            buffer = io.BytesIO()
+            try:
+                resized.save(buffer, fmt.upper(), quality=75 if fmt == 'webp' else 55)
+            except (KeyError, OSError):
+                continue
+            key = f'{folder}/{VARIANTS_DIR}/{stem}-{width}w.{fmt}'
+            s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=key,
+                Body=buffer.getvalue(),
+                ContentType=f'image/{fmt}',
+                CacheControl='public, max-age=31536000, immutable'
+            )
+            variants.setdefault(fmt, {})[str(width)] = f'{base_url}/{key}'
+    
+    tiny = image.copy()
+    tiny.thumbnail((IMAGE_PLACEHOLDER_WIDTH, IMAGE_PLACEHOLDER_WIDTH * 4))
+    buffer = io.BytesIO()
+    tiny.filter(ImageFilter.GaussianBlur(1)).save(buffer, 'WEBP', quality=30)
+    placeholder = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    
+    return {'variants': variants, 'placeholder': placeholder}
@@ -0,0 +1,167 @@
+'''
+Business: Эталон общего рантайма облачных функций: замер фаз запроса, профилирование, сжатие ответа
+Args: копируется в backend/*/index.py скриптом scripts/sync_runtime.py (def и class верхнего уровня)
+Returns: функции timed, log_event, compress_response и декоратор instrumented
+'''
+
+import base64
+import contextvars
+import gzip
+import hmac
+import io
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+    
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+    
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
+            
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+                
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+                
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
@@ -0,0 +1,87 @@
+'''
+Business: Эталон листинга папки медиабиблиотеки: рекурсивно, без _variants/, с постраничным курсором и вариантами
+Args: копируется в backend/*/index.py скриптом scripts/sync_runtime.py (def и class верхнего уровня)
+Returns: list_folder_page, общий для media-list и слайдера home-api
+'''
+
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from instrumentation import timed
+from storage import get_cdn_base_url, get_s3_client
+
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif')
+VARIANTS_DIR = '_variants'
+
+def split_variant_key(key: str) -> Optional[Tuple[str, int]]:
+    '''Разбирает ключ вида media/home/_variants/photo-640w.webp на (media/home/photo, 640)'''
+    folder, _, filename = key.rpartition(f'/{VARIANTS_DIR}/')
+    stem, _, suffix = filename.rpartition('-')
+    width = suffix.split('w.', 1)[0]
+    if not folder or not stem or not width.isdigit():
+        return None
+    return f'{folder}/{stem}', int(width)
+
+def list_variants(directories: List[str]) -> Dict[str, Dict[int, str]]:
+    '''Собирает варианты из <каталог>/_variants/ для каждого каталога, где лежат изображения страницы'''
+    s3 = get_s3_client()
+    base_url = get_cdn_base_url()
+    variants: Dict[str, Dict[int, str]] = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    with timed('s3_list'):
+        pages = [page for directory in directories for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f'{directory}/{VARIANTS_DIR}/')]
+    for page in pages:
+        for obj in page.get('Contents', []):
+            variant = split_variant_key(obj['Key'])
+            if variant and obj['Key'].lower().endswith('.webp'):
+                variants.setdefault(variant[0], {})[variant[1]] = f"{base_url}/{obj['Key']}"
+    return variants
+
+def list_folder_page(folder: str, limit: Optional[int], cursor: Optional[str], thumbnails: bool) -> Dict[str, Any]:
+    s3 = get_s3_client()
+    request = {'Bucket': S3_BUCKET, 'Prefix': f'media/{folder}/'}
+    if cursor:
+        request['ContinuationToken'] = cursor
+    
+    objects = []
+    next_cursor = None
+    while True:
+        if limit:
+            request['MaxKeys'] = limit - len(objects)
+        with timed('s3_list'):
+            response = s3.list_objects_v2(**request)
+        objects.extend(
+            obj for obj in response.get('Contents', [])
+            if f'/{VARIANTS_DIR}/' not in obj['Key'] and obj['Key'].lower().endswith(IMAGE_EXTENSIONS)
+        )
+        next_cursor = response.get('NextContinuationToken') if response.get('IsTruncated') else None
+        if not next_cursor or (limit and len(objects) >= limit):
+            break
+        request['ContinuationToken'] = next_cursor
+    
+    base_url = get_cdn_base_url()
+    directories = sorted({obj['Key'].rsplit('/', 1)[0] for obj in objects})
+    variants = list_variants(directories) if thumbnails else {}
+    images = []
+    for obj in objects:
+        key = obj['Key']
+        image = {
+            'key': key,
+            'url': f"{base_url}/{key}",
+            'size': obj['Size'],
+            'lastModified': obj['LastModified'].isoformat()
+        }
+        sizes = variants.get(key.rsplit('.', 1)[0])
+        if sizes:
+            widths = sorted(sizes)
+            image['thumbnail'] = sizes[widths[0]]
+            image['srcset'] = ', '.join(f"{sizes[width]} {width}w" for width in widths)
+        images.append(image)
+    
+    return {
+        'folder': folder,
+        'images': images,
+        'count': len(images),
+        'next_cursor': next_cursor
+    }
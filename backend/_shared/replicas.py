@@ -0,0 +1,138 @@
+'''
+Business: Эталон маршрутизации чтений на реплики Postgres с учётом отставания и read-your-writes
+Args: копируется в backend/*/index.py скриптом scripts/sync_runtime.py (def и class верхнего уровня)
+Returns: db_connection(readonly=True) и pin_reads_to_primary для функций с DATABASE_READ_URLS
+'''
+
+import contextvars
+import itertools
+import os
+import time
+import psycopg2
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Any, Dict, Iterator, Optional
+
+from db_pool import (
+    DB_POOL_MAX, DB_POOL_MIN, StaleConnectionError, TimedCursor, _db_last_used, _db_statements_run,
+    acquire_connection, get_db_pool, release_connection
+)
+from instrumentation import log_event, timed
+
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+DATABASE_READ_URLS = [
+    url.strip()
+    for url in (os.environ.get('DATABASE_READ_URLS') or os.environ.get('DATABASE_READ_URL') or '').split(',')
+    if url.strip()
+]
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+DB_READ_YOUR_WRITES_WINDOW = float(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', '15'))
+
+_replica_pools: Dict[str, ThreadedConnectionPool] = {}
+_replica_lag: Dict[str, Dict[str, Any]] = {}
+_replica_turn = itertools.count()
+_read_written_at: contextvars.ContextVar = contextvars.ContextVar('read_written_at', default=0.0)
+
+def get_replica_pool(dsn: str) -> ThreadedConnectionPool:
+    db_pool = _replica_pools.get(dsn)
+    if db_pool is None or db_pool.closed:
+        db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            dsn,
+            cursor_factory=TimedCursor,
+            connect_timeout=2,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+        _replica_pools[dsn] = db_pool
+    return db_pool
+
+def measure_replica_lag(dsn: str) -> Optional[float]:
+    try:
+        db_pool = get_replica_pool(dsn)
+        conn = acquire_connection(db_pool)
+    except psycopg2.Error:
+        return None
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                          END"""
+            )
+            return float(cur.fetchone()[0])
+    except psycopg2.Error:
+        broken = True
+        return None
+    finally:
+        release_connection(db_pool, conn, broken)
+
+def replica_is_fresh(dsn: str) -> bool:
+    state = _replica_lag.setdefault(dsn, {'lag': None, 'checked_at': 0.0})
+    now = time.monotonic()
+    if now - state['checked_at'] >= DB_REPLICA_CHECK_INTERVAL:
+        state['checked_at'] = now
+        state['lag'] = measure_replica_lag(dsn)
+        if state['lag'] is None or state['lag'] > DB_REPLICA_MAX_LAG:
+            log_event('replica_skipped', replica=DATABASE_READ_URLS.index(dsn), lag=state['lag'])
+    return state['lag'] is not None and state['lag'] <= DB_REPLICA_MAX_LAG
+
+def choose_replica() -> Optional[str]:
+    if not DATABASE_READ_URLS or reads_pinned():
+        return None
+    for _ in DATABASE_READ_URLS:
+        dsn = DATABASE_READ_URLS[next(_replica_turn) % len(DATABASE_READ_URLS)]
+        if replica_is_fresh(dsn):
+            return dsn
+    return None
+
+def reads_pinned() -> bool:
+    return abs(time.time() - _read_written_at.get()) < DB_READ_YOUR_WRITES_WINDOW
+
+def pin_reads_to_primary(headers: Dict[str, str]) -> bool:
+    '''Запоминает X-Last-Write в контексте запроса: свежая запись клиента читается с primary, а не с отстающей реплики'''
+    last_write = headers.get('X-Last-Write') or headers.get('x-last-write') or ''
+    try:
+        written_at = int(last_write) / 1000
+    except ValueError:
+        written_at = 0.0
+    _read_written_at.set(written_at)
+    return reads_pinned()
+
+@contextmanager
+def db_connection(readonly: bool = False) -> Iterator[Any]:
+    replica = choose_replica() if readonly else None
+    with timed('db_connect'):
+        db_pool = get_db_pool()
+        if replica:
+            try:
+                db_pool = get_replica_pool(replica)
+                conn = acquire_connection(db_pool)
+            except psycopg2.OperationalError:
+                _replica_lag[replica]['lag'] = None
+                replica, db_pool = None, get_db_pool()
+        if not replica:
+            conn = acquire_connection(db_pool)
+    broken = False
+    try:
+        if DB_POOL_MODE == 'transaction':
+            with conn:
+                yield conn
+        else:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        if replica:
+            _replica_lag[replica]['lag'] = None
+        if conn.closed:
+            _db_last_used.clear()
+            if not _db_statements_run.get(id(conn)):
+                raise StaleConnectionError(str(e).strip()) from e
+        raise
+    finally:
+        release_connection(db_pool, conn, broken)
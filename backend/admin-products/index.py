@@ -1,18 +1,311 @@
 '''
 Business: Административное API для управления товарами (создание, редактирование, удаление)
-Args: event - dict с httpMethod, body, headers с X-Admin-Token
+Args: event - dict с httpMethod, body, headers с X-Admin-Token,
+             queryStringParameters (id, action=import|export|derive-images|derive-media,
+             format=jsonl|csv, key, force=0 - не пересобирать актуальные варианты);
+             варианты изображений строятся отдельным вызовом derive-images, а не внутри записи
       context - object с request_id
 Returns: HTTP response с результатом операции
 '''
 
+import base64
+import contextvars
+import csv
+import gzip
+import hashlib
+import hmac
+import io
 import json
 import os
+import random
+import time
 import psycopg2
-from typing import Dict, Any, Optional
+from contextlib import contextmanager
+from functools import wraps
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Dict, Any, Iterator, Optional, Tuple, Callable
 
-def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_ERRORS = 1000
+IMPORT_SKU_MAX_LENGTH = 100
+IMPORT_PRICE_MAX = 2 ** 31 - 1
+EXPORT_FETCH_SIZE = 2000
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+VARIANTS_DIR = '_variants'
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_FORMATS = ('webp', 'avif')
+IMAGE_PLACEHOLDER_WIDTH = 16
+IMAGE_DOWNLOAD_TIMEOUT = 15
+IMAGE_MAX_BYTES = 25 * 1024 * 1024
+IMAGE_DERIVATIVES_ON_WRITE = os.environ.get('IMAGE_DERIVATIVES_ON_WRITE', '0') == '1'
+CATALOG_PUBLISH_TIMEOUT = float(os.environ.get('CATALOG_PUBLISH_TIMEOUT', '1'))
+
+CATEGORIES = ('interior', 'landscape')
+GLOW_COLORS = ('blue', 'purple', 'orange')
+BULK_COLUMNS = ('sku', 'name', 'category', 'price', 'image_url', 'glow_color', 'description')
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_last_used: Dict[int, float] = {}
+_db_statements_run: Dict[int, bool] = {}
+_s3_client = None
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+    
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+    
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
+            
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+                
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+                
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            result = super().execute(query, vars)
+        _db_statements_run[id(self.connection)] = True
+        return result
+    
+    def executemany(self, query, vars_list):
+        with timed('db_query'):
+            result = super().executemany(query, vars_list)
+        _db_statements_run[id(self.connection)] = True
+        return result
+
+class StaleConnectionError(psycopg2.OperationalError):
+    pass
+
+def retry_stale_connection(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except StaleConnectionError as e:
+            log_event('db_stale_connection_retry', function=func.__name__, error=str(e))
+            return func(*args, **kwargs)
+    return wrapper
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            os.environ.get('DATABASE_URL'),
+            cursor_factory=TimedCursor,
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _db_pool
+
+def is_connection_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def release_connection(db_pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        _db_last_used.pop(id(conn), None)
+        _db_statements_run.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        _db_last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+
+def acquire_connection(db_pool: ThreadedConnectionPool):
+    for _ in range(DB_POOL_MAX):
+        conn = db_pool.getconn()
+        if is_connection_alive(conn):
+            break
+        release_connection(db_pool, conn, broken=True)
+    else:
+        conn = db_pool.getconn()
+    _db_statements_run.pop(id(conn), None)
+    return conn
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    with timed('db_connect'):
+        db_pool = get_db_pool()
+        conn = acquire_connection(db_pool)
+    broken = False
+    try:
+        if DB_POOL_MODE == 'transaction':
+            with conn:
+                yield conn
+        else:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        if conn.closed:
+            _db_last_used.clear()
+            if not _db_statements_run.get(id(conn)):
+                raise StaleConnectionError(str(e).strip()) from e
+        raise
+    finally:
+        release_connection(db_pool, conn, broken)
 
 def verify_admin_token(headers: Dict[str, str]) -> bool:
     admin_token = os.environ.get('ADMIN_TOKEN')
@@ -23,8 +316,7 @@ def verify_admin_token(headers: Dict[str, str]) -> bool:
     return provided_token == admin_token
 
 def create_product(data: Dict[str, Any]) -> int:
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """INSERT INTO products 
@@ -42,17 +334,16 @@ def create_product(data: Dict[str, Any]) -> int:
             product_id = cur.fetchone()[0]
             conn.commit()
             return product_id
-    finally:
-        conn.close()
 
 def update_product(product_id: int, data: Dict[str, Any]) -> bool:
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """UPDATE products 
                    SET name = %s, category = %s, price = %s, 
                        image_url = %s, glow_color = %s, description = %s,
+                       image_variants = CASE WHEN image_url IS DISTINCT FROM %s THEN NULL ELSE image_variants END,
+                       image_placeholder = CASE WHEN image_url IS DISTINCT FROM %s THEN NULL ELSE image_placeholder END,
                        updated_at = CURRENT_TIMESTAMP
                    WHERE id = %s""",
                 (
@@ -62,24 +353,338 @@ def update_product(product_id: int, data: Dict[str, Any]) -> bool:
                     data['image_url'],
                     data.get('glow_color', 'blue'),
                     data.get('description', ''),
+                    data['image_url'],
+                    data['image_url'],
                     product_id
                 )
             )
             conn.commit()
             return cur.rowcount > 0
-    finally:
-        conn.close()
 
 def delete_product(product_id: int) -> bool:
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM products WHERE id = %s", (product_id,))
             conn.commit()
             return cur.rowcount > 0
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        )
+    return _s3_client
+
+def get_cdn_base_url() -> str:
+    return os.environ.get('CDN_BASE_URL') or f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket"
+
+def validate_image_url(url: str) -> str:
+    import ipaddress
+    import socket
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError('image_url must be an http(s) URL')
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, ValueError):
+        raise ValueError('image_url host cannot be resolved')
+    if not all(ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses):
+        raise ValueError('image_url must point to a public host')
+    return url
+
+def download_image(url: str) -> bytes:
+    import urllib.request
+    
+    class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, req, fp, code, msg, headers, newurl):
+            validate_image_url(newurl)
+            return super().redirect_request(req, fp, code, msg, headers, newurl)
+    
+    opener = urllib.request.build_opener(PublicRedirectHandler)
+    with opener.open(validate_image_url(url), timeout=IMAGE_DOWNLOAD_TIMEOUT) as response:
+        if int(response.headers.get('Content-Length') or 0) > IMAGE_MAX_BYTES:
+            raise ValueError('Image is too large')
+        data = response.read(IMAGE_MAX_BYTES + 1)
+    if len(data) > IMAGE_MAX_BYTES:
+        raise ValueError('Image is too large')
+    return data
+
+def build_image_variants(source: Any, base_key: str) -> Dict[str, Any]:
+    '''Сохраняет рядом с base_key (media/home/photo) варианты media/home/_variants/photo-640w.webp; source - файловый объект'''
+    from PIL import Image, ImageFilter, ImageOps
+    folder, _, stem = base_key.rpartition('/')
+    s3 = get_s3_client()
+    base_url = get_cdn_base_url()
+    
+    image = ImageOps.exif_transpose(Image.open(source))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    
+    variants: Dict[str, Dict[str, str]] = {}
+    for width in IMAGE_VARIANT_WIDTHS:
+        if width > image.width and width != IMAGE_VARIANT_WIDTHS[0]:
+            break
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        for fmt in IMAGE_VARIANT_FORMATS:
+            buffer = io.BytesIO()
+            try:
+                resized.save(buffer, fmt.upper(), quality=75 if fmt == 'webp' else 55)
+            except (KeyError, OSError):
+                continue
+            key = f'{folder}/{VARIANTS_DIR}/{stem}-{width}w.{fmt}'
+            s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=key,
+                Body=buffer.getvalue(),
+                ContentType=f'image/{fmt}',
+                CacheControl='public, max-age=31536000, immutable'
+            )
+            variants.setdefault(fmt, {})[str(width)] = f'{base_url}/{key}'
+    
+    tiny = image.copy()
+    tiny.thumbnail((IMAGE_PLACEHOLDER_WIDTH, IMAGE_PLACEHOLDER_WIDTH * 4))
+    buffer = io.BytesIO()
+    tiny.filter(ImageFilter.GaussianBlur(1)).save(buffer, 'WEBP', quality=30)
+    placeholder = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    
+    return {'variants': variants, 'placeholder': placeholder}
+
+def derive_product_images(product_id: int, force: bool = False) -> Optional[Dict[str, Any]]:
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT image_url, image_variants FROM products WHERE id = %s", (product_id,))
+            row = cur.fetchone()
+    if not row:
+        return None
+    
+    image_url, current = row
+    if current and current.get('source') == image_url and not force:
+        return current
+    
+    with timed('image_download'):
+        data = download_image(image_url)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    with timed('image_variants'):
+        result = build_image_variants(io.BytesIO(data), f'products/{product_id}/{digest}')
+    image_variants = {'source': image_url, **result['variants']}
+    
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE products SET image_variants = %s, image_placeholder = %s
+                   WHERE id = %s AND image_url = %s""",
+                (json.dumps(image_variants), result['placeholder'], product_id, image_url)
+            )
+            conn.commit()
+    
+    return image_variants
+
+def derive_media_images(key: str) -> Dict[str, Any]:
+    if not key.startswith('media/') or f'/{VARIANTS_DIR}/' in key:
+        raise ValueError('Key must point to an original image in media/')
+    body = get_s3_client().get_object(Bucket=S3_BUCKET, Key=key)['Body']
+    try:
+        data = body.read(IMAGE_MAX_BYTES + 1)
     finally:
-        conn.close()
+        body.close()
+    if len(data) > IMAGE_MAX_BYTES:
+        raise ValueError('Image is too large')
+    with timed('image_variants'):
+        return build_image_variants(io.BytesIO(data), key.rsplit('.', 1)[0])
+
+def derive_product_images_safely(product_id: int):
+    if not IMAGE_DERIVATIVES_ON_WRITE:
+        return
+    try:
+        derive_product_images(product_id)
+    except Exception as e:
+        log_event('image_derivatives_failed', product_id=product_id, error=str(e))
 
+def notify_catalog_publisher():
+    '''Публикатор публикует снимок внутри своего вызова; запрос ждёт его не дольше CATALOG_PUBLISH_TIMEOUT'''
+    publisher_url = os.environ.get('CATALOG_PUBLISHER_URL')
+    if not publisher_url:
+        return
+    import urllib.request
+    request = urllib.request.Request(
+        publisher_url,
+        data=b'',
+        method='POST',
+        headers={'X-Admin-Token': os.environ.get('ADMIN_TOKEN', '')}
+    )
+    try:
+        urllib.request.urlopen(request, timeout=CATALOG_PUBLISH_TIMEOUT).close()
+    except TimeoutError:
+        pass
+    except Exception as e:
+        log_event('catalog_publish_notify_failed', error=str(e))
+
+def iter_import_rows(body: str, fmt: str) -> Iterator[Tuple[int, Any]]:
+    stream = io.StringIO(body.lstrip('\ufeff'))
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    
+    for line_num, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError as e:
+            yield line_num, e
+
+def validate_import_row(row: Any) -> Tuple:
+    if isinstance(row, Exception):
+        raise ValueError(f'Invalid JSON: {row}')
+    if not isinstance(row, dict):
+        raise ValueError('Row must be an object')
+    
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not sku:
+        raise ValueError('sku is required')
+    if len(sku) > IMPORT_SKU_MAX_LENGTH:
+        raise ValueError(f'sku must be at most {IMPORT_SKU_MAX_LENGTH} characters')
+    if not name:
+        raise ValueError('name is required')
+    if row.get('category') not in CATEGORIES:
+        raise ValueError(f"category must be one of: {', '.join(CATEGORIES)}")
+    glow_color = row.get('glow_color') or 'blue'
+    if glow_color not in GLOW_COLORS:
+        raise ValueError(f"glow_color must be one of: {', '.join(GLOW_COLORS)}")
+    if not row.get('image_url'):
+        raise ValueError('image_url is required')
+    try:
+        price = int(row.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError('price must be an integer')
+    if not 0 <= price <= IMPORT_PRICE_MAX:
+        raise ValueError(f'price must be between 0 and {IMPORT_PRICE_MAX}')
+    
+    return (sku, name[:255], row['category'], price, row['image_url'], glow_color, row.get('description') or '')
+
+def upsert_product_batch(conn, batch: Dict[str, Tuple]) -> Tuple[int, int]:
+    from psycopg2.extras import execute_values
+    with conn.cursor() as cur:
+        results = execute_values(
+            cur,
+            """INSERT INTO products (sku, name, category, price, image_url, glow_color, description)
+               VALUES %s
+               ON CONFLICT (sku) DO UPDATE SET
+                   name = EXCLUDED.name, category = EXCLUDED.category, price = EXCLUDED.price,
+                   image_url = EXCLUDED.image_url, glow_color = EXCLUDED.glow_color,
+                   description = EXCLUDED.description,
+                   image_variants = CASE WHEN products.image_url IS DISTINCT FROM EXCLUDED.image_url
+                                         THEN NULL ELSE products.image_variants END,
+                   image_placeholder = CASE WHEN products.image_url IS DISTINCT FROM EXCLUDED.image_url
+                                            THEN NULL ELSE products.image_placeholder END,
+                   updated_at = CURRENT_TIMESTAMP
+               RETURNING (xmax = 0)""",
+            list(batch.values()),
+            page_size=len(batch),
+            fetch=True
+        )
+    conn.commit()
+    inserted = sum(1 for (is_insert,) in results if is_insert)
+    return inserted, len(results) - inserted
+
+def import_products(body: str, fmt: str) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    
+    def record_error(line: int, message: str):
+        summary['failed'] += 1
+        if len(summary['errors']) < IMPORT_MAX_ERRORS:
+            summary['errors'].append({'line': line, 'error': message})
+    
+    def flush(conn, batch: Dict[str, Tuple], lines: Dict[str, int]):
+        try:
+            inserted, updated = upsert_product_batch(conn, batch)
+            summary['inserted'] += inserted
+            summary['updated'] += updated
+            return
+        except psycopg2.DatabaseError:
+            conn.rollback()
+        
+        for sku, values in batch.items():
+            try:
+                inserted, updated = upsert_product_batch(conn, {sku: values})
+                summary['inserted'] += inserted
+                summary['updated'] += updated
+            except psycopg2.DatabaseError as e:
+                conn.rollback()
+                record_error(lines[sku], str(e).strip())
+    
+    with db_connection() as conn:
+        batch: Dict[str, Tuple] = {}
+        lines: Dict[str, int] = {}
+        for line, row in iter_import_rows(body, fmt):
+            try:
+                values = validate_import_row(row)
+            except ValueError as e:
+                record_error(line, str(e))
+                continue
+            
+            batch.pop(values[0], None)
+            batch[values[0]] = values
+            lines[values[0]] = line
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(conn, batch, lines)
+                batch, lines = {}, {}
+        
+        if batch:
+            flush(conn, batch, lines)
+    
+    return summary
+
+def export_products(fmt: str) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(('id',) + BULK_COLUMNS)
+    
+    with db_connection() as conn:
+        with conn.cursor(name='products_export') as cur:
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute(f"SELECT id, {', '.join(BULK_COLUMNS)} FROM products ORDER BY id")
+            for row in cur:
+                if writer:
+                    writer.writerow(row)
+                else:
+                    output.write(json.dumps(dict(zip(('id',) + BULK_COLUMNS, row)), ensure_ascii=False))
+                    output.write('\n')
+    
+    return output.getvalue()
+
+def get_bulk_format(event: Dict[str, Any], params: Dict[str, str]) -> str:
+    if params.get('format') in ('csv', 'jsonl'):
+        return params['format']
+    headers = event.get('headers', {}) or {}
+    content_type = headers.get('Content-Type') or headers.get('content-type') or ''
+    return 'csv' if 'csv' in content_type else 'jsonl'
+
+def stamp_last_write(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response = func(event, context)
+        if event.get('httpMethod') in ('POST', 'PUT', 'DELETE') and response.get('statusCode', 500) < 300:
+            headers = response.setdefault('headers', {})
+            headers['X-Last-Write'] = str(int(time.time() * 1000))
+            exposed = headers.get('Access-Control-Expose-Headers')
+            headers['Access-Control-Expose-Headers'] = f'{exposed}, X-Last-Write' if exposed else 'X-Last-Write'
+        return response
+    return wrapper
+
+@instrumented('admin-products')
+@stamp_last_write
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     headers = event.get('headers', {})
@@ -90,7 +695,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token, X-Last-Write',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -110,9 +715,86 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
+        params = event.get('queryStringParameters', {}) or {}
+        action = params.get('action')
+        
+        if method == 'GET' and action == 'export':
+            fmt = get_bulk_format(event, params)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson',
+                    'Content-Disposition': f'attachment; filename="products.{fmt}"',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': export_products(fmt)
+            }
+        
+        if method == 'POST' and action == 'import':
+            body = event.get('body') or ''
+            if event.get('isBase64Encoded'):
+                body = base64.b64decode(body).decode('utf-8-sig')
+            summary = import_products(body, get_bulk_format(event, params))
+            if summary['inserted'] or summary['updated']:
+                notify_catalog_publisher()
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': summary['failed'] == 0,
+                    **summary
+                })
+            }
+        
+        if method == 'POST' and action in ('derive-images', 'derive-media'):
+            try:
+                if action == 'derive-images':
+                    result = derive_product_images(int(params.get('id') or 0), force=params.get('force') != '0')
+                else:
+                    result = derive_media_images(params.get('key') or '')
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            if result is None:
+                return {
+                    'statusCode': 404,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Product not found'})
+                }
+            
+            if action == 'derive-images':
+                notify_catalog_publisher()
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': True,
+                    'images': result
+                })
+            }
+        
         if method == 'POST':
             body = json.loads(event.get('body', '{}'))
             product_id = create_product(body)
+            derive_product_images_safely(product_id)
+            notify_catalog_publisher()
             
             return {
                 'statusCode': 201,
@@ -128,7 +810,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         elif method == 'PUT':
-            params = event.get('queryStringParameters', {}) or {}
             product_id = params.get('id')
             
             if not product_id:
@@ -143,6 +824,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             body = json.loads(event.get('body', '{}'))
             updated = update_product(int(product_id), body)
+            if updated:
+                derive_product_images_safely(int(product_id))
+                notify_catalog_publisher()
             
             if not updated:
                 return {
@@ -167,7 +851,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         elif method == 'DELETE':
-            params = event.get('queryStringParameters', {}) or {}
             product_id = params.get('id')
             
             if not product_id:
@@ -181,6 +864,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             deleted = delete_product(int(product_id))
+            if deleted:
+                notify_catalog_publisher()
             
             if not deleted:
                 return {
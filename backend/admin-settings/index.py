@@ -1,18 +1,384 @@
 '''
 Business: API для управления настройками сайта через админ-панель
-Args: event - dict с httpMethod, body, headers с X-Admin-Token
+Args: event - dict с httpMethod, body, headers с X-Admin-Token (не нужен для GET ?scope=public)
       context - object с request_id
 Returns: HTTP response с настройками или статусом операции
 '''
 
+import base64
+import contextvars
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
 import json
 import os
+import random
+import time
 import psycopg2
-from typing import Dict, Any
+from contextlib import contextmanager
+from functools import wraps
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Dict, Any, Iterator, Optional, Callable
 
-def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+DATABASE_READ_URLS = [
+    url.strip()
+    for url in (os.environ.get('DATABASE_READ_URLS') or os.environ.get('DATABASE_READ_URL') or '').split(',')
+    if url.strip()
+]
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+DB_READ_YOUR_WRITES_WINDOW = float(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', '15'))
+
+SETTINGS_VERSION_CHECK_INTERVAL = float(os.environ.get('SETTINGS_VERSION_CHECK_INTERVAL', '5'))
+SETTINGS_CACHE_MAX_AGE = int(os.environ.get('SETTINGS_CACHE_MAX_AGE', '60'))
+SETTINGS_CACHE_STALE_WHILE_REVALIDATE = int(os.environ.get('SETTINGS_CACHE_STALE_WHILE_REVALIDATE', '600'))
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_last_used: Dict[int, float] = {}
+_db_statements_run: Dict[int, bool] = {}
+_replica_pools: Dict[str, ThreadedConnectionPool] = {}
+_replica_lag: Dict[str, Dict[str, Any]] = {}
+_replica_turn = itertools.count()
+_read_written_at: contextvars.ContextVar = contextvars.ContextVar('read_written_at', default=0.0)
+_settings_snapshot: Dict[str, Any] = {'version': None, 'checked_at': 0.0, 'body': None, 'etag': None}
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+    
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+    
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
+            
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+                
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+                
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            result = super().execute(query, vars)
+        _db_statements_run[id(self.connection)] = True
+        return result
+    
+    def executemany(self, query, vars_list):
+        with timed('db_query'):
+            result = super().executemany(query, vars_list)
+        _db_statements_run[id(self.connection)] = True
+        return result
+
+class StaleConnectionError(psycopg2.OperationalError):
+    pass
+
+def retry_stale_connection(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except StaleConnectionError as e:
+            log_event('db_stale_connection_retry', function=func.__name__, error=str(e))
+            return func(*args, **kwargs)
+    return wrapper
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            os.environ.get('DATABASE_URL'),
+            cursor_factory=TimedCursor,
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _db_pool
+
+def get_replica_pool(dsn: str) -> ThreadedConnectionPool:
+    db_pool = _replica_pools.get(dsn)
+    if db_pool is None or db_pool.closed:
+        db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            dsn,
+            cursor_factory=TimedCursor,
+            connect_timeout=2,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+        _replica_pools[dsn] = db_pool
+    return db_pool
+
+def is_connection_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def release_connection(db_pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        _db_last_used.pop(id(conn), None)
+        _db_statements_run.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        _db_last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+
+def acquire_connection(db_pool: ThreadedConnectionPool):
+    for _ in range(DB_POOL_MAX):
+        conn = db_pool.getconn()
+        if is_connection_alive(conn):
+            break
+        release_connection(db_pool, conn, broken=True)
+    else:
+        conn = db_pool.getconn()
+    _db_statements_run.pop(id(conn), None)
+    return conn
+
+def measure_replica_lag(dsn: str) -> Optional[float]:
+    try:
+        db_pool = get_replica_pool(dsn)
+        conn = acquire_connection(db_pool)
+    except psycopg2.Error:
+        return None
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                          END"""
+            )
+            return float(cur.fetchone()[0])
+    except psycopg2.Error:
+        broken = True
+        return None
+    finally:
+        release_connection(db_pool, conn, broken)
+
+def replica_is_fresh(dsn: str) -> bool:
+    state = _replica_lag.setdefault(dsn, {'lag': None, 'checked_at': 0.0})
+    now = time.monotonic()
+    if now - state['checked_at'] >= DB_REPLICA_CHECK_INTERVAL:
+        state['checked_at'] = now
+        state['lag'] = measure_replica_lag(dsn)
+        if state['lag'] is None or state['lag'] > DB_REPLICA_MAX_LAG:
+            log_event('replica_skipped', replica=DATABASE_READ_URLS.index(dsn), lag=state['lag'])
+    return state['lag'] is not None and state['lag'] <= DB_REPLICA_MAX_LAG
+
+def choose_replica() -> Optional[str]:
+    if not DATABASE_READ_URLS or reads_pinned():
+        return None
+    for _ in DATABASE_READ_URLS:
+        dsn = DATABASE_READ_URLS[next(_replica_turn) % len(DATABASE_READ_URLS)]
+        if replica_is_fresh(dsn):
+            return dsn
+    return None
+
+def pin_reads_to_primary(headers: Dict[str, str]) -> bool:
+    '''Запоминает X-Last-Write в контексте запроса: свежая запись клиента читается с primary, а не с отстающей реплики'''
+    last_write = headers.get('X-Last-Write') or headers.get('x-last-write') or ''
+    try:
+        written_at = int(last_write) / 1000
+    except ValueError:
+        written_at = 0.0
+    _read_written_at.set(written_at)
+    return reads_pinned()
+
+def reads_pinned() -> bool:
+    return abs(time.time() - _read_written_at.get()) < DB_READ_YOUR_WRITES_WINDOW
+
+@contextmanager
+def db_connection(readonly: bool = False) -> Iterator[Any]:
+    replica = choose_replica() if readonly else None
+    with timed('db_connect'):
+        db_pool = get_db_pool()
+        if replica:
+            try:
+                db_pool = get_replica_pool(replica)
+                conn = acquire_connection(db_pool)
+            except psycopg2.OperationalError:
+                _replica_lag[replica]['lag'] = None
+                replica, db_pool = None, get_db_pool()
+        if not replica:
+            conn = acquire_connection(db_pool)
+    broken = False
+    try:
+        if DB_POOL_MODE == 'transaction':
+            with conn:
+                yield conn
+        else:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        if replica:
+            _replica_lag[replica]['lag'] = None
+        if conn.closed:
+            _db_last_used.clear()
+            if not _db_statements_run.get(id(conn)):
+                raise StaleConnectionError(str(e).strip()) from e
+        raise
+    finally:
+        release_connection(db_pool, conn, broken)
 
 def verify_admin_token(headers: Dict[str, str]) -> bool:
     admin_token = os.environ.get('ADMIN_TOKEN')
@@ -22,51 +388,97 @@ def verify_admin_token(headers: Dict[str, str]) -> bool:
     provided_token = headers.get('X-Admin-Token') or headers.get('x-admin-token')
     return provided_token == admin_token
 
-def get_settings() -> Dict[str, Any]:
-    conn = get_db_connection()
-    try:
+def load_settings(cur) -> Dict[str, Any]:
+    cur.execute(
+        "SELECT key, value FROM site_settings ORDER BY key"
+    )
+    rows = cur.fetchall()
+    
+    settings = {}
+    for row in rows:
+        try:
+            settings[row[0]] = json.loads(row[1])
+        except:
+            settings[row[0]] = row[1]
+    
+    return settings
+
+@retry_stale_connection
+def get_settings_snapshot() -> Dict[str, Any]:
+    now = time.monotonic()
+    if (
+        _settings_snapshot['body'] is not None
+        and not reads_pinned()
+        and now - _settings_snapshot['checked_at'] < SETTINGS_VERSION_CHECK_INTERVAL
+    ):
+        return _settings_snapshot
+    
+    with db_connection(readonly=True) as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT key, value FROM site_settings ORDER BY key"
-            )
-            rows = cur.fetchall()
-            
-            settings = {}
-            for row in rows:
-                try:
-                    settings[row[0]] = json.loads(row[1])
-                except:
-                    settings[row[0]] = row[1]
+            cur.execute("SELECT version FROM cache_versions WHERE name = 'settings'")
+            row = cur.fetchone()
+            version = row[0] if row else None
             
-            return settings
-    finally:
-        conn.close()
+            if _settings_snapshot['body'] is None or version != _settings_snapshot['version']:
+                settings = load_settings(cur)
+                with timed('serialize'):
+                    body = json.dumps({
+                        'success': True,
+                        'settings': settings
+                    })
+                _settings_snapshot['body'] = body
+                _settings_snapshot['etag'] = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+                _settings_snapshot['version'] = version
+    
+    _settings_snapshot['checked_at'] = now
+    return _settings_snapshot
 
 def save_settings(settings: Dict[str, Any]) -> bool:
-    conn = get_db_connection()
-    try:
+    from psycopg2.extras import execute_values
+    rows = [
+        (key, value if isinstance(value, str) else json.dumps(value))
+        for key, value in settings.items()
+    ]
+    
+    with db_connection() as conn:
         with conn.cursor() as cur:
-            for key, value in settings.items():
-                value_str = json.dumps(value) if not isinstance(value, str) else value
-                
-                cur.execute(
-                    """INSERT INTO site_settings (key, value)
-                       VALUES (%s, %s)
-                       ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP""",
-                    (key, value_str)
-                )
-            
+            execute_values(
+                cur,
+                """INSERT INTO site_settings (key, value)
+                   VALUES %s
+                   ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP""",
+                rows,
+                page_size=len(rows)
+            )
             conn.commit()
-            return True
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    
+    _settings_snapshot['checked_at'] = 0.0
+    return True
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def stamp_last_write(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response = func(event, context)
+        if event.get('httpMethod') in ('POST', 'PUT', 'DELETE') and response.get('statusCode', 500) < 300:
+            headers = response.setdefault('headers', {})
+            headers['X-Last-Write'] = str(int(time.time() * 1000))
+            exposed = headers.get('Access-Control-Expose-Headers')
+            headers['Access-Control-Expose-Headers'] = f'{exposed}, X-Last-Write' if exposed else 'X-Last-Write'
+        return response
+    return wrapper
 
+@instrumented('admin-settings')
+@stamp_last_write
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
-    headers = event.get('headers', {})
+    headers = event.get('headers', {}) or {}
+    params = event.get('queryStringParameters', {}) or {}
     
     if method == 'OPTIONS':
         return {
@@ -74,12 +486,54 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token, If-None-Match, X-Last-Write',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    pinned = pin_reads_to_primary(headers)
+    
+    if method == 'GET' and params.get('scope') == 'public':
+        try:
+            snapshot = get_settings_snapshot()
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': str(e)})
+            }
+        
+        cache_headers = {
+            'ETag': snapshot['etag'],
+            'Cache-Control': 'private, no-store' if pinned else (
+                f'public, max-age={SETTINGS_CACHE_MAX_AGE}, '
+                f'stale-while-revalidate={SETTINGS_CACHE_STALE_WHILE_REVALIDATE}'
+            ),
+            'Vary': 'X-Last-Write',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        }
+        
+        if etag_matches(headers.get('If-None-Match') or headers.get('if-none-match'), snapshot['etag']):
+            return {
+                'statusCode': 304,
+                'headers': cache_headers,
+                'body': ''
+            }
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                **cache_headers
+            },
+            'body': snapshot['body']
+        }
+    
     if not verify_admin_token(headers):
         return {
             'statusCode': 401,
@@ -95,18 +549,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     try:
         if method == 'GET':
-            settings = get_settings()
-            
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
-                    'success': True,
-                    'settings': settings
-                })
+                'body': get_settings_snapshot()['body']
             }
         
         elif method == 'POST':
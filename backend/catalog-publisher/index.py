@@ -0,0 +1,556 @@
+'''
+Business: Публикация статических снимков каталога в хранилище за CDN (catalog/v<version>/...)
+Args: event - dict с httpMethod; POST с X-Admin-Token (?force=1) публикует снимок и повторяет
+             публикацию, если версия каталога успела измениться,
+             GET возвращает текущий манифест catalog/current.json; точка входа worker для расписания
+      context - object с request_id
+Returns: HTTP response с результатом публикации или манифестом
+'''
+
+import base64
+import contextvars
+import gzip
+import hmac
+import io
+import json
+import os
+import random
+import threading
+import time
+import psycopg2
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Dict, Any, Iterator, List, Optional, Callable, Tuple
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+CATALOG_PREFIX = os.environ.get('CATALOG_PREFIX', 'catalog')
+CATALOG_MANIFEST_KEY = f'{CATALOG_PREFIX}/current.json'
+CATALOG_KEEP_VERSIONS = int(os.environ.get('CATALOG_KEEP_VERSIONS', '3'))
+CATALOG_UPLOAD_WORKERS = int(os.environ.get('CATALOG_UPLOAD_WORKERS', '16'))
+CATALOG_MANIFEST_MAX_AGE = int(os.environ.get('CATALOG_MANIFEST_MAX_AGE', '30'))
+CATALOG_PUBLISH_MAX_ROUNDS = int(os.environ.get('CATALOG_PUBLISH_MAX_ROUNDS', '3'))
+PRODUCT_FIELDS = (
+    ('id', 'p.id'),
+    ('name', 'p.name'),
+    ('category', 'p.category'),
+    ('price', 'p.price'),
+    ('image', 'p.image_url'),
+    ('glow', 'p.glow_color'),
+    ('description', 'p.description'),
+    ('created_at', 'p.created_at'),
+    ('images', "CASE WHEN p.image_variants->>'source' = p.image_url THEN p.image_variants END"),
+    ('placeholder', "CASE WHEN p.image_variants->>'source' = p.image_url THEN p.image_placeholder END")
+)
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_last_used: Dict[int, float] = {}
+_db_statements_run: Dict[int, bool] = {}
+_s3_client = None
+_publish_lock = threading.Lock()
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+    
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+    
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
+            
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+                
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+                
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            result = super().execute(query, vars)
+        _db_statements_run[id(self.connection)] = True
+        return result
+    
+    def executemany(self, query, vars_list):
+        with timed('db_query'):
+            result = super().executemany(query, vars_list)
+        _db_statements_run[id(self.connection)] = True
+        return result
+
+class StaleConnectionError(psycopg2.OperationalError):
+    pass
+
+def retry_stale_connection(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except StaleConnectionError as e:
+            log_event('db_stale_connection_retry', function=func.__name__, error=str(e))
+            return func(*args, **kwargs)
+    return wrapper
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            os.environ.get('DATABASE_URL'),
+            cursor_factory=TimedCursor,
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _db_pool
+
+def is_connection_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def release_connection(db_pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        _db_last_used.pop(id(conn), None)
+        _db_statements_run.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        _db_last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+
+def acquire_connection(db_pool: ThreadedConnectionPool):
+    for _ in range(DB_POOL_MAX):
+        conn = db_pool.getconn()
+        if is_connection_alive(conn):
+            break
+        release_connection(db_pool, conn, broken=True)
+    else:
+        conn = db_pool.getconn()
+    _db_statements_run.pop(id(conn), None)
+    return conn
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    with timed('db_connect'):
+        db_pool = get_db_pool()
+        conn = acquire_connection(db_pool)
+    broken = False
+    try:
+        if DB_POOL_MODE == 'transaction':
+            with conn:
+                yield conn
+        else:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        if conn.closed:
+            _db_last_used.clear()
+            if not _db_statements_run.get(id(conn)):
+                raise StaleConnectionError(str(e).strip()) from e
+        raise
+    finally:
+        release_connection(db_pool, conn, broken)
+
+def verify_admin_token(headers: Dict[str, str]) -> bool:
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    
+    provided_token = headers.get('X-Admin-Token') or headers.get('x-admin-token')
+    return provided_token == admin_token
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        )
+    return _s3_client
+
+def get_cdn_base_url() -> str:
+    return os.environ.get('CDN_BASE_URL') or f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket"
+
+@retry_stale_connection
+def load_catalog() -> Tuple[Optional[int], List[Tuple[int, str, str, str]]]:
+    card_pairs = ', '.join(f"'{field}', {column}" for field, column in PRODUCT_FIELDS)
+    
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            cur.execute("SELECT version FROM cache_versions WHERE name = 'catalog'")
+            row = cur.fetchone()
+            cur.execute(
+                f"""SELECT p.id, p.category,
+                           json_build_object({card_pairs})::text,
+                           json_build_object(
+                               {card_pairs},
+                               'gallery', COALESCE(
+                                   (SELECT json_agg(pi.image_url ORDER BY pi.position) FROM product_images pi WHERE pi.product_id = p.id),
+                                   json_build_array(p.image_url)
+                               )
+                           )::text
+                    FROM products p
+                    ORDER BY p.created_at DESC, p.id DESC"""
+            )
+            products = cur.fetchall()
+    
+    return (row[0] if row else None), products
+
+def catalog_document(cards: List[str]) -> bytes:
+    return f'{{"products": [{", ".join(cards)}], "count": {len(cards)}, "next_cursor": null}}'.encode('utf-8')
+
+def upload_json(key: str, body: bytes, cache_control: str):
+    get_s3_client().put_object(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Body=gzip.compress(body, compresslevel=6),
+        ContentType='application/json; charset=utf-8',
+        ContentEncoding='gzip',
+        CacheControl=cache_control
+    )
+
+def read_manifest() -> Optional[Dict[str, Any]]:
+    from botocore.exceptions import ClientError
+    try:
+        response = get_s3_client().get_object(Bucket=S3_BUCKET, Key=CATALOG_MANIFEST_KEY)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    body = response['Body'].read()
+    if response.get('ContentEncoding') == 'gzip':
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+def prune_versions(current_version: int) -> int:
+    s3 = get_s3_client()
+    versions = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=S3_BUCKET, Prefix=f'{CATALOG_PREFIX}/v', Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            name = common_prefix['Prefix'][len(CATALOG_PREFIX) + 2:].rstrip('/')
+            if name.isdigit() and int(name) <= current_version:
+                versions.append(int(name))
+    
+    removed = 0
+    for version in sorted(versions, reverse=True)[CATALOG_KEEP_VERSIONS:]:
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=S3_BUCKET, Prefix=f'{CATALOG_PREFIX}/v{version}/'):
+            keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+            if keys:
+                s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': keys, 'Quiet': True})
+                removed += len(keys)
+    return removed
+
+def publish_catalog(force: bool = False) -> Dict[str, Any]:
+    version, products = load_catalog()
+    if version is None:
+        raise RuntimeError('Catalog version is not initialized')
+    
+    manifest = read_manifest()
+    if manifest and not force and manifest.get('version', 0) >= version:
+        return {'published': False, 'version': manifest.get('version')}
+    
+    prefix = f'{CATALOG_PREFIX}/v{version}'
+    cards: List[str] = []
+    categories: Dict[str, List[str]] = {}
+    documents: List[Tuple[str, bytes]] = []
+    for product_id, category, card, detail in products:
+        cards.append(card)
+        categories.setdefault(category, []).append(card)
+        documents.append((f'{prefix}/product/{product_id}.json', detail.encode('utf-8')))
+    documents.append((f'{prefix}/products.json', catalog_document(cards)))
+    for category, category_cards in categories.items():
+        documents.append((f'{prefix}/category/{category}.json', catalog_document(category_cards)))
+    
+    with timed('s3_upload'), ThreadPoolExecutor(max_workers=CATALOG_UPLOAD_WORKERS) as executor:
+        list(executor.map(lambda document: upload_json(*document, 'public, max-age=31536000, immutable'), documents))
+    
+    latest = read_manifest()
+    if latest and not force and latest.get('version', 0) > version:
+        return {'published': False, 'version': latest.get('version')}
+    
+    manifest = {
+        'version': version,
+        'prefix': prefix,
+        'base_url': f'{get_cdn_base_url()}/{prefix}',
+        'products': f'{prefix}/products.json',
+        'categories': {category: f'{prefix}/category/{category}.json' for category in sorted(categories)},
+        'product': f'{prefix}/product/{{id}}.json',
+        'count': len(cards),
+        'published_at': datetime.now(timezone.utc).isoformat()
+    }
+    upload_json(
+        CATALOG_MANIFEST_KEY,
+        json.dumps(manifest).encode('utf-8'),
+        f'public, max-age={CATALOG_MANIFEST_MAX_AGE}, must-revalidate'
+    )
+    
+    return {
+        'published': True,
+        'version': version,
+        'count': len(cards),
+        'files': len(documents),
+        'removed': prune_versions(version)
+    }
+
+@retry_stale_connection
+def get_catalog_version() -> Optional[int]:
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM cache_versions WHERE name = 'catalog'")
+            row = cur.fetchone()
+    return row[0] if row else None
+
+def publish_catalog_until_current(force: bool = False) -> Dict[str, Any]:
+    '''Если за время публикации каталог снова изменился, публикует ещё раз, чтобы запись не ждала следующего тика'''
+    with _publish_lock:
+        result = publish_catalog(force)
+        rounds = 1
+        while rounds < CATALOG_PUBLISH_MAX_ROUNDS:
+            version = get_catalog_version()
+            if version is None or version <= (result.get('version') or 0):
+                break
+            result = publish_catalog()
+            rounds += 1
+    return {**result, 'rounds': rounds}
+
+def worker(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Точка входа для триггера по расписанию: публикует снимок, если версия каталога изменилась'''
+    result = publish_catalog_until_current()
+    log_event('catalog_publish', request_id=getattr(context, 'request_id', None), **result)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'ok': True, **result})
+    }
+
+@instrumented('catalog-publisher')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    headers = event.get('headers', {}) or {}
+    params = event.get('queryStringParameters', {}) or {}
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    try:
+        if method == 'GET':
+            manifest = read_manifest()
+            return {
+                'statusCode': 200 if manifest else 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps(manifest or {'error': 'Catalog snapshot not published yet'})
+            }
+        
+        if method == 'POST':
+            if not verify_admin_token(headers):
+                return {
+                    'statusCode': 401,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Unauthorized'})
+                }
+            
+            result = publish_catalog_until_current(force=params.get('force') == '1')
+            log_event('catalog_publish', request_id=getattr(context, 'request_id', None), **result)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': True, **result})
+            }
+        
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e)})
+        }
@@ -0,0 +1,662 @@
+'''
+Business: Агрегированные данные главной страницы одним запросом: товары, слайдер и настройки сайта
+Args: event - dict с httpMethod, queryStringParameters (sections=products,slider,settings),
+             headers (If-None-Match, Accept-Encoding, X-Last-Write - свежая запись читается с primary)
+      context - object с request_id
+Returns: JSON документ с секциями и ETag каждой секции
+'''
+
+import base64
+import contextvars
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import os
+import random
+import time
+import psycopg2
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Callable
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+DATABASE_READ_URLS = [
+    url.strip()
+    for url in (os.environ.get('DATABASE_READ_URLS') or os.environ.get('DATABASE_READ_URL') or '').split(',')
+    if url.strip()
+]
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+DB_READ_YOUR_WRITES_WINDOW = float(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', '15'))
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif')
+VARIANTS_DIR = '_variants'
+
+HOME_PRODUCTS_LIMIT = int(os.environ.get('HOME_PRODUCTS_LIMIT', '12'))
+HOME_SLIDER_FOLDER = os.environ.get('HOME_SLIDER_FOLDER', 'home')
+HOME_SLIDER_MAX_IMAGES = int(os.environ.get('HOME_SLIDER_MAX_IMAGES', '50'))
+HOME_VERSION_CHECK_INTERVAL = float(os.environ.get('HOME_VERSION_CHECK_INTERVAL', '2'))
+HOME_SLIDER_TTL = float(os.environ.get('HOME_SLIDER_TTL', '60'))
+HOME_CACHE_MAX_AGE = int(os.environ.get('HOME_CACHE_MAX_AGE', '30'))
+HOME_CACHE_STALE_WHILE_REVALIDATE = int(os.environ.get('HOME_CACHE_STALE_WHILE_REVALIDATE', '300'))
+HOME_SECTIONS = ('products', 'slider', 'settings')
+PRODUCT_CARD_FIELDS = (
+    ('id', 'p.id'),
+    ('name', 'p.name'),
+    ('category', 'p.category'),
+    ('price', 'p.price'),
+    ('image', 'p.image_url'),
+    ('glow', 'p.glow_color'),
+    ('images', "CASE WHEN p.image_variants->>'source' = p.image_url THEN p.image_variants END"),
+    ('placeholder', "CASE WHEN p.image_variants->>'source' = p.image_url THEN p.image_placeholder END")
+)
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_last_used: Dict[int, float] = {}
+_db_statements_run: Dict[int, bool] = {}
+_replica_pools: Dict[str, ThreadedConnectionPool] = {}
+_replica_lag: Dict[str, Dict[str, Any]] = {}
+_replica_turn = itertools.count()
+_read_written_at: contextvars.ContextVar = contextvars.ContextVar('read_written_at', default=0.0)
+_s3_client = None
+_sections: Dict[str, Dict[str, Any]] = {}
+_versions: Dict[str, Any] = {'values': {}, 'checked_at': 0.0}
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+    
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+    
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
+            
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+                
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+                
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            result = super().execute(query, vars)
+        _db_statements_run[id(self.connection)] = True
+        return result
+    
+    def executemany(self, query, vars_list):
+        with timed('db_query'):
+            result = super().executemany(query, vars_list)
+        _db_statements_run[id(self.connection)] = True
+        return result
+
+class StaleConnectionError(psycopg2.OperationalError):
+    pass
+
+def retry_stale_connection(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except StaleConnectionError as e:
+            log_event('db_stale_connection_retry', function=func.__name__, error=str(e))
+            return func(*args, **kwargs)
+    return wrapper
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            os.environ.get('DATABASE_URL'),
+            cursor_factory=TimedCursor,
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _db_pool
+
+def get_replica_pool(dsn: str) -> ThreadedConnectionPool:
+    db_pool = _replica_pools.get(dsn)
+    if db_pool is None or db_pool.closed:
+        db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            dsn,
+            cursor_factory=TimedCursor,
+            connect_timeout=2,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+        _replica_pools[dsn] = db_pool
+    return db_pool
+
+def is_connection_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def release_connection(db_pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        _db_last_used.pop(id(conn), None)
+        _db_statements_run.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        _db_last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+
+def acquire_connection(db_pool: ThreadedConnectionPool):
+    for _ in range(DB_POOL_MAX):
+        conn = db_pool.getconn()
+        if is_connection_alive(conn):
+            break
+        release_connection(db_pool, conn, broken=True)
+    else:
+        conn = db_pool.getconn()
+    _db_statements_run.pop(id(conn), None)
+    return conn
+
+def measure_replica_lag(dsn: str) -> Optional[float]:
+    try:
+        db_pool = get_replica_pool(dsn)
+        conn = acquire_connection(db_pool)
+    except psycopg2.Error:
+        return None
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                          END"""
+            )
+            return float(cur.fetchone()[0])
+    except psycopg2.Error:
+        broken = True
+        return None
+    finally:
+        release_connection(db_pool, conn, broken)
+
+def replica_is_fresh(dsn: str) -> bool:
+    state = _replica_lag.setdefault(dsn, {'lag': None, 'checked_at': 0.0})
+    now = time.monotonic()
+    if now - state['checked_at'] >= DB_REPLICA_CHECK_INTERVAL:
+        state['checked_at'] = now
+        state['lag'] = measure_replica_lag(dsn)
+        if state['lag'] is None or state['lag'] > DB_REPLICA_MAX_LAG:
+            log_event('replica_skipped', replica=DATABASE_READ_URLS.index(dsn), lag=state['lag'])
+    return state['lag'] is not None and state['lag'] <= DB_REPLICA_MAX_LAG
+
+def choose_replica() -> Optional[str]:
+    if not DATABASE_READ_URLS or reads_pinned():
+        return None
+    for _ in DATABASE_READ_URLS:
+        dsn = DATABASE_READ_URLS[next(_replica_turn) % len(DATABASE_READ_URLS)]
+        if replica_is_fresh(dsn):
+            return dsn
+    return None
+
+def reads_pinned() -> bool:
+    return abs(time.time() - _read_written_at.get()) < DB_READ_YOUR_WRITES_WINDOW
+
+def pin_reads_to_primary(headers: Dict[str, str]) -> bool:
+    '''Запоминает X-Last-Write в контексте запроса: свежая запись клиента читается с primary, а не с отстающей реплики'''
+    last_write = headers.get('X-Last-Write') or headers.get('x-last-write') or ''
+    try:
+        written_at = int(last_write) / 1000
+    except ValueError:
+        written_at = 0.0
+    _read_written_at.set(written_at)
+    return reads_pinned()
+
+@contextmanager
+def db_connection(readonly: bool = False) -> Iterator[Any]:
+    replica = choose_replica() if readonly else None
+    with timed('db_connect'):
+        db_pool = get_db_pool()
+        if replica:
+            try:
+                db_pool = get_replica_pool(replica)
+                conn = acquire_connection(db_pool)
+            except psycopg2.OperationalError:
+                _replica_lag[replica]['lag'] = None
+                replica, db_pool = None, get_db_pool()
+        if not replica:
+            conn = acquire_connection(db_pool)
+    broken = False
+    try:
+        if DB_POOL_MODE == 'transaction':
+            with conn:
+                yield conn
+        else:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        if replica:
+            _replica_lag[replica]['lag'] = None
+        if conn.closed:
+            _db_last_used.clear()
+            if not _db_statements_run.get(id(conn)):
+                raise StaleConnectionError(str(e).strip()) from e
+        raise
+    finally:
+        release_connection(db_pool, conn, broken)
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        )
+    return _s3_client
+
+def get_cdn_base_url() -> str:
+    return os.environ.get('CDN_BASE_URL') or f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket"
+
+def make_etag(body: str) -> str:
+    return '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+
+@retry_stale_connection
+def get_cache_versions() -> Dict[str, int]:
+    now = time.monotonic()
+    if not reads_pinned() and now - _versions['checked_at'] < HOME_VERSION_CHECK_INTERVAL:
+        return _versions['values']
+    
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT name, version FROM cache_versions WHERE name IN ('catalog', 'settings')")
+            _versions['values'] = dict(cur.fetchall())
+    _versions['checked_at'] = now
+    return _versions['values']
+
+@retry_stale_connection
+def render_products() -> str:
+    pairs = ', '.join(f"'{field}', {column}" for field, column in PRODUCT_CARD_FIELDS)
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT COALESCE(json_agg(json_build_object({pairs}) ORDER BY p.created_at DESC, p.id DESC), '[]')::text
+                    FROM (SELECT * FROM products ORDER BY created_at DESC, id DESC LIMIT %s) p""",
+                (HOME_PRODUCTS_LIMIT,)
+            )
+            return cur.fetchone()[0]
+
+@retry_stale_connection
+def render_settings() -> str:
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT key, value FROM site_settings ORDER BY key")
+            rows = cur.fetchall()
+    
+    settings = {}
+    for key, value in rows:
+        try:
+            settings[key] = json.loads(value)
+        except ValueError:
+            settings[key] = value
+    return json.dumps(settings)
+
+def split_variant_key(key: str) -> Optional[Tuple[str, int]]:
+    '''Разбирает ключ вида media/home/_variants/photo-640w.webp на (media/home/photo, 640)'''
+    folder, _, filename = key.rpartition(f'/{VARIANTS_DIR}/')
+    stem, _, suffix = filename.rpartition('-')
+    width = suffix.split('w.', 1)[0]
+    if not folder or not stem or not width.isdigit():
+        return None
+    return f'{folder}/{stem}', int(width)
+
+def list_variants(directories: List[str]) -> Dict[str, Dict[int, str]]:
+    '''Собирает варианты из <каталог>/_variants/ для каждого каталога, где лежат изображения страницы'''
+    s3 = get_s3_client()
+    base_url = get_cdn_base_url()
+    variants: Dict[str, Dict[int, str]] = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    with timed('s3_list'):
+        pages = [page for directory in directories for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f'{directory}/{VARIANTS_DIR}/')]
+    for page in pages:
+        for obj in page.get('Contents', []):
+            variant = split_variant_key(obj['Key'])
+            if variant and obj['Key'].lower().endswith('.webp'):
+                variants.setdefault(variant[0], {})[variant[1]] = f"{base_url}/{obj['Key']}"
+    return variants
+
+def list_folder_page(folder: str, limit: Optional[int], cursor: Optional[str], thumbnails: bool) -> Dict[str, Any]:
+    s3 = get_s3_client()
+    request = {'Bucket': S3_BUCKET, 'Prefix': f'media/{folder}/'}
+    if cursor:
+        request['ContinuationToken'] = cursor
+    
+    objects = []
+    next_cursor = None
+    while True:
+        if limit:
+            request['MaxKeys'] = limit - len(objects)
+        with timed('s3_list'):
+            response = s3.list_objects_v2(**request)
+        objects.extend(
+            obj for obj in response.get('Contents', [])
+            if f'/{VARIANTS_DIR}/' not in obj['Key'] and obj['Key'].lower().endswith(IMAGE_EXTENSIONS)
+        )
+        next_cursor = response.get('NextContinuationToken') if response.get('IsTruncated') else None
+        if not next_cursor or (limit and len(objects) >= limit):
+            break
+        request['ContinuationToken'] = next_cursor
+    
+    base_url = get_cdn_base_url()
+    directories = sorted({obj['Key'].rsplit('/', 1)[0] for obj in objects})
+    variants = list_variants(directories) if thumbnails else {}
+    images = []
+    for obj in objects:
+        key = obj['Key']
+        image = {
+            'key': key,
+            'url': f"{base_url}/{key}",
+            'size': obj['Size'],
+            'lastModified': obj['LastModified'].isoformat()
+        }
+        sizes = variants.get(key.rsplit('.', 1)[0])
+        if sizes:
+            widths = sorted(sizes)
+            image['thumbnail'] = sizes[widths[0]]
+            image['srcset'] = ', '.join(f"{sizes[width]} {width}w" for width in widths)
+        images.append(image)
+    
+    return {
+        'folder': folder,
+        'images': images,
+        'count': len(images),
+        'next_cursor': next_cursor
+    }
+
+def render_slider() -> str:
+    '''Те же правила, что у media-list?folder=home&thumbnails=1: вложенные папки, без _variants/, с превью и srcset'''
+    return json.dumps(list_folder_page(HOME_SLIDER_FOLDER, HOME_SLIDER_MAX_IMAGES, None, True))
+
+def load_section(name: str, versions: Dict[str, int]) -> Dict[str, Any]:
+    now = time.monotonic()
+    version = versions.get('catalog') if name == 'products' else versions.get('settings') if name == 'settings' else None
+    entry = _sections.get(name)
+    if entry and entry['version'] == version and (entry['expires_at'] is None or entry['expires_at'] > now):
+        return entry
+    
+    if name == 'products':
+        body = render_products()
+    elif name == 'settings':
+        body = render_settings()
+    else:
+        body = render_slider()
+    
+    entry = {
+        'body': body,
+        'etag': make_etag(body),
+        'version': version,
+        'expires_at': now + HOME_SLIDER_TTL if name == 'slider' else None
+    }
+    _sections[name] = entry
+    return entry
+
+def get_home_document(sections: List[str]) -> Dict[str, Any]:
+    versions = get_cache_versions() if any(name != 'slider' for name in sections) else {}
+    contexts = {name: contextvars.copy_context() for name in sections}
+    with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+        entries = dict(zip(sections, executor.map(lambda name: contexts[name].run(load_section, name, versions), sections)))
+    
+    etags = {name: entry['etag'] for name, entry in entries.items()}
+    parts = [f'{json.dumps(name)}: {entry["body"]}' for name, entry in entries.items()]
+    body = '{' + ', '.join(parts + [f'"etags": {json.dumps(etags)}']) + '}'
+    return {
+        'body': body,
+        'etag': make_etag(''.join(f'{name}={etag}' for name, etag in etags.items()))
+    }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+@instrumented('home-api')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    headers = event.get('headers', {}) or {}
+    params = event.get('queryStringParameters', {}) or {}
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-Last-Write',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    sections = [name.strip() for name in (params.get('sections') or ','.join(HOME_SECTIONS)).split(',') if name.strip()]
+    unknown = [name for name in sections if name not in HOME_SECTIONS]
+    if unknown or not sections:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': f"Unknown sections: {', '.join(unknown)}" if unknown else 'No sections requested'})
+        }
+    
+    try:
+        pinned = pin_reads_to_primary(headers)
+        document = get_home_document(list(dict.fromkeys(sections)))
+        cache_headers = {
+            'ETag': document['etag'],
+            'Cache-Control': 'private, no-store' if pinned else (
+                f'public, max-age={HOME_CACHE_MAX_AGE}, '
+                f'stale-while-revalidate={HOME_CACHE_STALE_WHILE_REVALIDATE}'
+            ),
+            'Vary': 'X-Last-Write',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        }
+        
+        if etag_matches(headers.get('If-None-Match') or headers.get('if-none-match'), document['etag']):
+            return {
+                'statusCode': 304,
+                'headers': cache_headers,
+                'body': ''
+            }
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                **cache_headers
+            },
+            'body': document['body']
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e)})
+        }
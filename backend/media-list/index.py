@@ -1,10 +1,325 @@
+import base64
+import contextvars
+import gzip
+import hashlib
+import hmac
+import io
 import json
 import os
-import boto3
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif')
+VARIANTS_DIR = '_variants'
 
+MEDIA_CACHE_TTL = float(os.environ.get('MEDIA_CACHE_TTL', '60'))
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', '60'))
+MEDIA_CACHE_STALE_WHILE_REVALIDATE = int(os.environ.get('MEDIA_CACHE_STALE_WHILE_REVALIDATE', '600'))
+MEDIA_CACHE_MAX_ENTRIES = int(os.environ.get('MEDIA_CACHE_MAX_ENTRIES', '128'))
+MEDIA_MAX_PAGE_SIZE = 1000
+MEDIA_CURSOR_MAX_LENGTH = 1024
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_s3_client = None
+_listing_cache: Dict[str, Dict[str, Any]] = {}
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
+
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        )
+    return _s3_client
+
+
+def get_cdn_base_url() -> str:
+    return os.environ.get('CDN_BASE_URL') or f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket"
+
+
+def split_variant_key(key: str) -> Optional[Tuple[str, int]]:
+    '''Разбирает ключ вида media/home/_variants/photo-640w.webp на (media/home/photo, 640)'''
+    folder, _, filename = key.rpartition(f'/{VARIANTS_DIR}/')
+    stem, _, suffix = filename.rpartition('-')
+    width = suffix.split('w.', 1)[0]
+    if not folder or not stem or not width.isdigit():
+        return None
+    return f'{folder}/{stem}', int(width)
+
+
+def list_variants(directories: List[str]) -> Dict[str, Dict[int, str]]:
+    '''Собирает варианты из <каталог>/_variants/ для каждого каталога, где лежат изображения страницы'''
+    s3 = get_s3_client()
+    base_url = get_cdn_base_url()
+    variants: Dict[str, Dict[int, str]] = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    with timed('s3_list'):
+        pages = [page for directory in directories for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f'{directory}/{VARIANTS_DIR}/')]
+    for page in pages:
+        for obj in page.get('Contents', []):
+            variant = split_variant_key(obj['Key'])
+            if variant and obj['Key'].lower().endswith('.webp'):
+                variants.setdefault(variant[0], {})[variant[1]] = f"{base_url}/{obj['Key']}"
+    return variants
+
+
+def list_folder_page(folder: str, limit: Optional[int], cursor: Optional[str], thumbnails: bool) -> Dict[str, Any]:
+    s3 = get_s3_client()
+    request = {'Bucket': S3_BUCKET, 'Prefix': f'media/{folder}/'}
+    if cursor:
+        request['ContinuationToken'] = cursor
+
+    objects = []
+    next_cursor = None
+    while True:
+        if limit:
+            request['MaxKeys'] = limit - len(objects)
+        with timed('s3_list'):
+            response = s3.list_objects_v2(**request)
+        objects.extend(
+            obj for obj in response.get('Contents', [])
+            if f'/{VARIANTS_DIR}/' not in obj['Key'] and obj['Key'].lower().endswith(IMAGE_EXTENSIONS)
+        )
+        next_cursor = response.get('NextContinuationToken') if response.get('IsTruncated') else None
+        if not next_cursor or (limit and len(objects) >= limit):
+            break
+        request['ContinuationToken'] = next_cursor
+
+    base_url = get_cdn_base_url()
+    directories = sorted({obj['Key'].rsplit('/', 1)[0] for obj in objects})
+    variants = list_variants(directories) if thumbnails else {}
+    images = []
+    for obj in objects:
+        key = obj['Key']
+        image = {
+            'key': key,
+            'url': f"{base_url}/{key}",
+            'size': obj['Size'],
+            'lastModified': obj['LastModified'].isoformat()
+        }
+        sizes = variants.get(key.rsplit('.', 1)[0])
+        if sizes:
+            widths = sorted(sizes)
+            image['thumbnail'] = sizes[widths[0]]
+            image['srcset'] = ', '.join(f"{sizes[width]} {width}w" for width in widths)
+        images.append(image)
+
+    return {
+        'folder': folder,
+        'images': images,
+        'count': len(images),
+        'next_cursor': next_cursor
+    }
+
+
+def get_cached_listing(folder: str, limit: Optional[int], cursor: Optional[str], thumbnails: bool) -> Dict[str, Any]:
+    cache_key = json.dumps([folder, limit, cursor, thumbnails])
+    now = time.monotonic()
+    entry = _listing_cache.get(cache_key)
+    if entry and entry['expires_at'] > now:
+        return entry
+
+    listing = list_folder_page(folder, limit, cursor, thumbnails)
+    with timed('serialize'):
+        body = json.dumps(listing)
+    entry = {
+        'body': body,
+        'etag': '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"',
+        'expires_at': now + MEDIA_CACHE_TTL
+    }
+
+    _listing_cache.pop(cache_key, None)
+    while len(_listing_cache) >= MEDIA_CACHE_MAX_ENTRIES:
+        _listing_cache.pop(next(iter(_listing_cache)))
+    _listing_cache[cache_key] = entry
+    return entry
+
+
+def parse_listing_params(params: Dict[str, str]) -> Tuple[Optional[int], Optional[str]]:
+    limit = None
+    if params.get('limit'):
+        if not params['limit'].isdigit():
+            raise ValueError('limit must be a positive integer')
+        limit = min(max(int(params['limit']), 1), MEDIA_MAX_PAGE_SIZE)
+    cursor = params.get('cursor') or None
+    if cursor and (len(cursor) > MEDIA_CURSOR_MAX_LENGTH or not cursor.isascii() or not cursor.isprintable()):
+        raise ValueError('Invalid cursor')
+    return limit, cursor
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+@instrumented('media-list')
 def handler(event: dict, context) -> dict:
-    '''Получает список изображений из указанной папки медиабиблиотеки'''
+    '''Получает список изображений из указанной папки медиабиблиотеки вместе с вложенными подпапками (limit/cursor, thumbnails=1 для превью и srcset)'''
     method = event.get('httpMethod', 'GET')
 
     if method == 'OPTIONS':
@@ -13,7 +328,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -29,45 +344,50 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({'error': 'Method not allowed'})
         }
 
-    folder = event.get('queryStringParameters', {}).get('folder', 'home')
+    params = event.get('queryStringParameters', {}) or {}
+    headers = event.get('headers', {}) or {}
+    folder = params.get('folder', 'home')
 
-    s3 = boto3.client(
-        's3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-    )
+    try:
+        limit, cursor = parse_listing_params(params)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e)})
+        }
 
     try:
-        response = s3.list_objects_v2(
-            Bucket='files',
-            Prefix=f'media/{folder}/'
-        )
+        thumbnails = params.get('thumbnails') in ('1', 'true')
+        listing = get_cached_listing(folder, limit, cursor, thumbnails)
 
-        images = []
-        if 'Contents' in response:
-            base_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket"
-            for obj in response['Contents']:
-                key = obj['Key']
-                if key.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                    images.append({
-                        'key': key,
-                        'url': f"{base_url}/{key}",
-                        'size': obj['Size'],
-                        'lastModified': obj['LastModified'].isoformat()
-                    })
+        cache_headers = {
+            'ETag': listing['etag'],
+            'Cache-Control': (
+                f'public, max-age={MEDIA_CACHE_MAX_AGE}, '
+                f'stale-while-revalidate={MEDIA_CACHE_STALE_WHILE_REVALIDATE}'
+            ),
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        }
+
+        if etag_matches(headers.get('If-None-Match') or headers.get('if-none-match'), listing['etag']):
+            return {
+                'statusCode': 304,
+                'headers': cache_headers,
+                'body': ''
+            }
 
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                **cache_headers
             },
-            'body': json.dumps({
-                'folder': folder,
-                'images': images,
-                'count': len(images)
-            })
+            'body': listing['body']
         }
 
     except Exception as e:
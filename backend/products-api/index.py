@@ -1,64 +1,685 @@
 '''
 Business: API для получения списка товаров из базы данных
-Args: event - dict с httpMethod, queryStringParameters
+Args: event - dict с httpMethod, queryStringParameters (id, ids, category, fields, limit, cursor,
+             min_price, max_price, glow, q, offset, image_width), headers (If-None-Match, X-Last-Write, X-Profile-Token);
+             POST body {"ids": [...], "fields": [...]} для пакетного получения товаров
       context - object с request_id
 Returns: JSON список товаров или детали товара
 '''
 
+import base64
+import contextvars
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
 import json
 import os
+import random
+import time
 import psycopg2
-from typing import Dict, Any, List
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Callable
 
-def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def get_all_products(category: str = None) -> List[Dict[str, Any]]:
-    conn = get_db_connection()
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+DATABASE_READ_URLS = [
+    url.strip()
+    for url in (os.environ.get('DATABASE_READ_URLS') or os.environ.get('DATABASE_READ_URL') or '').split(',')
+    if url.strip()
+]
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+DB_READ_YOUR_WRITES_WINDOW = float(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', '15'))
+
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '3600'))
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', '2'))
+CATALOG_CACHE_MAX_AGE = int(os.environ.get('CATALOG_CACHE_MAX_AGE', '30'))
+CATALOG_CACHE_STALE_WHILE_REVALIDATE = int(os.environ.get('CATALOG_CACHE_STALE_WHILE_REVALIDATE', '300'))
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', '256'))
+CATALOG_MAX_PAGE_SIZE = int(os.environ.get('CATALOG_MAX_PAGE_SIZE', '100'))
+CATALOG_SEARCH_PAGE_SIZE = int(os.environ.get('CATALOG_SEARCH_PAGE_SIZE', '20'))
+CATALOG_SEARCH_MAX_LENGTH = 200
+CATALOG_JSON_MODE = os.environ.get('CATALOG_JSON_MODE', 'db')
+CATALOG_MAX_BATCH_IDS = int(os.environ.get('CATALOG_MAX_BATCH_IDS', '100'))
+
+PRODUCT_COLUMNS = {
+    'id': 'id',
+    'name': 'name',
+    'category': 'category',
+    'price': 'price',
+    'image': 'image_url',
+    'glow': 'glow_color',
+    'description': 'description',
+    'created_at': 'created_at',
+    'images': 'image_variants',
+    'placeholder': 'image_placeholder'
+}
+PRODUCT_FRESH_IMAGE_SQL = {
+    'images': "CASE WHEN {alias}.image_variants->>'source' = {alias}.image_url THEN {alias}.image_variants END",
+    'placeholder': "CASE WHEN {alias}.image_variants->>'source' = {alias}.image_url THEN {alias}.image_placeholder END"
+}
+GLOW_COLORS = ('blue', 'purple', 'orange')
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_last_used: Dict[int, float] = {}
+_db_statements_run: Dict[int, bool] = {}
+_replica_pools: Dict[str, ThreadedConnectionPool] = {}
+_replica_lag: Dict[str, Dict[str, Any]] = {}
+_replica_turn = itertools.count()
+_read_written_at: contextvars.ContextVar = contextvars.ContextVar('read_written_at', default=0.0)
+_catalog_cache: Dict[str, Dict[str, Any]] = {}
+_catalog_version: Dict[str, Any] = {'value': None, 'checked_at': 0.0}
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
     try:
-        with conn.cursor() as cur:
-            if category and category != 'all':
-                cur.execute(
-                    """SELECT id, name, category, price, image_url, glow_color, description, created_at
-                       FROM products WHERE category = %s ORDER BY created_at DESC""",
-                    (category,)
-                )
-            else:
-                cur.execute(
-                    """SELECT id, name, category, price, image_url, glow_color, description, created_at
-                       FROM products ORDER BY created_at DESC"""
-                )
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+    
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+    
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
             
-            rows = cur.fetchall()
-            products = []
-            for row in rows:
-                products.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'category': row[2],
-                    'price': row[3],
-                    'image': row[4],
-                    'glow': row[5],
-                    'description': row[6],
-                    'created_at': row[7].isoformat() if row[7] else None
-                })
-            return products
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+                
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+                
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            result = super().execute(query, vars)
+        _db_statements_run[id(self.connection)] = True
+        return result
+    
+    def executemany(self, query, vars_list):
+        with timed('db_query'):
+            result = super().executemany(query, vars_list)
+        _db_statements_run[id(self.connection)] = True
+        return result
+
+class StaleConnectionError(psycopg2.OperationalError):
+    pass
+
+def retry_stale_connection(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except StaleConnectionError as e:
+            log_event('db_stale_connection_retry', function=func.__name__, error=str(e))
+            return func(*args, **kwargs)
+    return wrapper
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            os.environ.get('DATABASE_URL'),
+            cursor_factory=TimedCursor,
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _db_pool
+
+def get_replica_pool(dsn: str) -> ThreadedConnectionPool:
+    db_pool = _replica_pools.get(dsn)
+    if db_pool is None or db_pool.closed:
+        db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            dsn,
+            cursor_factory=TimedCursor,
+            connect_timeout=2,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+        _replica_pools[dsn] = db_pool
+    return db_pool
+
+def is_connection_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def release_connection(db_pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        _db_last_used.pop(id(conn), None)
+        _db_statements_run.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        _db_last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+
+def acquire_connection(db_pool: ThreadedConnectionPool):
+    for _ in range(DB_POOL_MAX):
+        conn = db_pool.getconn()
+        if is_connection_alive(conn):
+            break
+        release_connection(db_pool, conn, broken=True)
+    else:
+        conn = db_pool.getconn()
+    _db_statements_run.pop(id(conn), None)
+    return conn
+
+def measure_replica_lag(dsn: str) -> Optional[float]:
+    try:
+        db_pool = get_replica_pool(dsn)
+        conn = acquire_connection(db_pool)
+    except psycopg2.Error:
+        return None
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                          END"""
+            )
+            return float(cur.fetchone()[0])
+    except psycopg2.Error:
+        broken = True
+        return None
     finally:
-        conn.close()
+        release_connection(db_pool, conn, broken)
 
-def get_product_by_id(product_id: int) -> Dict[str, Any]:
-    conn = get_db_connection()
+def replica_is_fresh(dsn: str) -> bool:
+    state = _replica_lag.setdefault(dsn, {'lag': None, 'checked_at': 0.0})
+    now = time.monotonic()
+    if now - state['checked_at'] >= DB_REPLICA_CHECK_INTERVAL:
+        state['checked_at'] = now
+        state['lag'] = measure_replica_lag(dsn)
+        if state['lag'] is None or state['lag'] > DB_REPLICA_MAX_LAG:
+            log_event('replica_skipped', replica=DATABASE_READ_URLS.index(dsn), lag=state['lag'])
+    return state['lag'] is not None and state['lag'] <= DB_REPLICA_MAX_LAG
+
+def choose_replica() -> Optional[str]:
+    if not DATABASE_READ_URLS or reads_pinned():
+        return None
+    for _ in DATABASE_READ_URLS:
+        dsn = DATABASE_READ_URLS[next(_replica_turn) % len(DATABASE_READ_URLS)]
+        if replica_is_fresh(dsn):
+            return dsn
+    return None
+
+def pin_reads_to_primary(headers: Dict[str, str]) -> bool:
+    '''Запоминает X-Last-Write в контексте запроса: свежая запись клиента читается с primary, а не с отстающей реплики'''
+    last_write = headers.get('X-Last-Write') or headers.get('x-last-write') or ''
+    try:
+        written_at = int(last_write) / 1000
+    except ValueError:
+        written_at = 0.0
+    _read_written_at.set(written_at)
+    return reads_pinned()
+
+def reads_pinned() -> bool:
+    return abs(time.time() - _read_written_at.get()) < DB_READ_YOUR_WRITES_WINDOW
+
+@contextmanager
+def db_connection(readonly: bool = False) -> Iterator[Any]:
+    replica = choose_replica() if readonly else None
+    with timed('db_connect'):
+        db_pool = get_db_pool()
+        if replica:
+            try:
+                db_pool = get_replica_pool(replica)
+                conn = acquire_connection(db_pool)
+            except psycopg2.OperationalError:
+                _replica_lag[replica]['lag'] = None
+                replica, db_pool = None, get_db_pool()
+        if not replica:
+            conn = acquire_connection(db_pool)
+    broken = False
     try:
+        if DB_POOL_MODE == 'transaction':
+            with conn:
+                yield conn
+        else:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        if replica:
+            _replica_lag[replica]['lag'] = None
+        if conn.closed:
+            _db_last_used.clear()
+            if not _db_statements_run.get(id(conn)):
+                raise StaleConnectionError(str(e).strip()) from e
+        raise
+    finally:
+        release_connection(db_pool, conn, broken)
+
+def encode_cursor(created_at: datetime, product_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), product_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, product_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(product_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def parse_catalog_query(params: Dict[str, str]) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    
+    category = params.get('category')
+    if category and category != 'all':
+        query['category'] = category
+    
+    if params.get('fields'):
+        query['fields'] = parse_fields(params['fields'])
+    
+    if params.get('limit'):
+        query['limit'] = min(max(int(params['limit']), 1), CATALOG_MAX_PAGE_SIZE)
+    
+    search_text = (params.get('q') or '').strip()
+    if search_text:
+        if len(search_text) > CATALOG_SEARCH_MAX_LENGTH:
+            raise ValueError('Search query is too long')
+        query['q'] = search_text
+        if params.get('offset'):
+            query['offset'] = max(int(params['offset']), 0)
+    
+    if params.get('cursor') and 'q' not in query:
+        decode_cursor(params['cursor'])
+        query['cursor'] = params['cursor']
+    
+    if params.get('image_width'):
+        query['image_width'] = min(max(int(params['image_width']), 1), 4096)
+    
+    for name in ('min_price', 'max_price'):
+        if params.get(name):
+            query[name] = int(params[name])
+    
+    if params.get('glow'):
+        glow = sorted({color.strip() for color in params['glow'].split(',') if color.strip()})
+        unknown = [color for color in glow if color not in GLOW_COLORS]
+        if unknown:
+            raise ValueError(f"Unknown glow colors: {', '.join(unknown)}")
+        query['glow'] = glow
+    
+    return query
+
+def parse_product_ids(raw: Any) -> List[int]:
+    values = raw.split(',') if isinstance(raw, str) else raw
+    if not isinstance(values, list):
+        raise ValueError('ids must be a list or a comma-separated string')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values if str(value).strip()))
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+    if not ids:
+        raise ValueError('ids must not be empty')
+    if len(ids) > CATALOG_MAX_BATCH_IDS:
+        raise ValueError(f'No more than {CATALOG_MAX_BATCH_IDS} ids per request')
+    return ids
+
+def parse_fields(raw: Any) -> List[str]:
+    fields = [field.strip() for field in (raw.split(',') if isinstance(raw, str) else raw) if field.strip()]
+    unknown = [field for field in fields if field not in PRODUCT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def build_product_filters(query: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    conditions = []
+    args: List[Any] = []
+    
+    if 'category' in query:
+        conditions.append('category = %s')
+        args.append(query['category'])
+    if 'min_price' in query:
+        conditions.append('price >= %s')
+        args.append(query['min_price'])
+    if 'max_price' in query:
+        conditions.append('price <= %s')
+        args.append(query['max_price'])
+    if 'glow' in query:
+        conditions.append('glow_color = ANY(%s)')
+        args.append(query['glow'])
+    
+    return conditions, args
+
+def fresh_image_variants(variants: Optional[Dict[str, Any]], image_url: Optional[str]) -> Optional[Dict[str, Any]]:
+    '''Варианты, построенные из прежнего image_url, не отдаются: derive-images мог ещё не пересобрать их'''
+    if variants and variants.get('source') == image_url:
+        return variants
+    return None
+
+def pick_image_variant(variants: Optional[Dict[str, Any]], width: int) -> Optional[str]:
+    sizes = (variants or {}).get('webp') or {}
+    widths = sorted(int(size) for size in sizes)
+    if not widths:
+        return None
+    chosen = next((size for size in widths if size >= width), widths[-1])
+    return sizes[str(chosen)]
+
+def product_select_list(fields: List[str], query: Dict[str, Any]) -> str:
+    columns = [PRODUCT_COLUMNS[field] for field in fields]
+    if needs_image_source(fields, query):
+        columns.extend(['image_url', 'image_variants'])
+    return ', '.join(columns)
+
+def needs_image_source(fields: List[str], query: Dict[str, Any]) -> bool:
+    return bool(query.get('image_width') and 'image' in fields) or 'images' in fields or 'placeholder' in fields
+
+def row_to_product(fields: List[str], values: Tuple[Any, ...], image_width: Optional[int] = None) -> Dict[str, Any]:
+    product = dict(zip(fields, values))
+    if product.get('created_at'):
+        product['created_at'] = product['created_at'].isoformat()
+    if len(values) > len(fields):
+        variants = fresh_image_variants(values[-1], values[-2])
+        if 'images' in product:
+            product['images'] = variants
+        if 'placeholder' in product and variants is None:
+            product['placeholder'] = None
+        if image_width and 'image' in product:
+            product['image'] = pick_image_variant(variants, image_width) or product['image']
+    return product
+
+def dumps_json(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value)
+
+def product_column_sql(field: str, alias: str) -> str:
+    if field in PRODUCT_FRESH_IMAGE_SQL:
+        return PRODUCT_FRESH_IMAGE_SQL[field].format(alias=alias)
+    return f'{alias}.{PRODUCT_COLUMNS[field]}'
+
+def json_pairs_sql(fields: List[str], alias: str) -> str:
+    return ', '.join(f"'{field}', {product_column_sql(field, alias)}" for field in fields)
+
+@retry_stale_connection
+def get_all_products(query: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    fields = query.get('fields') or list(PRODUCT_COLUMNS)
+    conditions, args = build_product_filters(query)
+    
+    if 'cursor' in query:
+        conditions.append('(created_at, id) < (%s, %s)')
+        args.extend(decode_cursor(query['cursor']))
+    
+    sql = f"SELECT id, created_at, {product_select_list(fields, query)} FROM products"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY created_at DESC, id DESC'
+    
+    limit = query.get('limit')
+    if limit:
+        sql += ' LIMIT %s'
+        args.append(limit + 1)
+    
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, args)
+            rows = cur.fetchall()
+    
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    
+    with timed('map_rows'):
+        products = [row_to_product(fields, row[2:], query.get('image_width')) for row in rows]
+    return products, next_cursor
+
+@retry_stale_connection
+def get_all_products_json(query: Dict[str, Any]) -> str:
+    fields = query.get('fields') or list(PRODUCT_COLUMNS)
+    conditions, args = build_product_filters(query)
+    
+    if 'cursor' in query:
+        conditions.append('(created_at, id) < (%s, %s)')
+        args.extend(decode_cursor(query['cursor']))
+    
+    columns = [PRODUCT_COLUMNS[field] for field in fields]
+    if needs_image_source(fields, query):
+        columns.extend(['image_url', 'image_variants'])
+    columns = ', '.join(dict.fromkeys(['id', 'created_at'] + columns))
+    page_sql = f"SELECT {columns}, row_number() OVER (ORDER BY created_at DESC, id DESC) AS rn FROM products"
+    if conditions:
+        page_sql += ' WHERE ' + ' AND '.join(conditions)
+    page_sql += ' ORDER BY created_at DESC, id DESC'
+    
+    limit = query.get('limit')
+    if limit:
+        page_sql += ' LIMIT %s'
+        args.append(limit + 1)
+    
+    sql = f"""SELECT COALESCE(json_agg(json_build_object({json_pairs_sql(fields, 'p')}) ORDER BY p.rn) FILTER (WHERE p.rn <= %s), '[]')::text,
+                     count(*) FILTER (WHERE p.rn <= %s),
+                     count(*),
+                     max(p.created_at) FILTER (WHERE p.rn = %s),
+                     max(p.id) FILTER (WHERE p.rn = %s)
+              FROM ({page_sql}) p"""
+    last = limit or 2 ** 31 - 1
+    
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, [last, last, last, last] + args)
+            products_json, count, total, last_created_at, last_id = cur.fetchone()
+    
+    next_cursor = encode_cursor(last_created_at, last_id) if limit and total > limit else None
+    return f'{{"products": {products_json}, "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
+
+@retry_stale_connection
+def search_products(query: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    fields = query.get('fields') or list(PRODUCT_COLUMNS)
+    conditions, filter_args = build_product_filters(query)
+    conditions.append('(search_vector @@ ts.query OR %s <%% search_text)')
+    limit = query.get('limit') or CATALOG_SEARCH_PAGE_SIZE
+    offset = query.get('offset', 0)
+    search_text = query['q'].lower()
+    
+    sql = f"""SELECT {product_select_list(fields, query)}
+              FROM products,
+                   (SELECT websearch_to_tsquery('russian', %s) || websearch_to_tsquery('english', %s) AS query) ts
+              WHERE {' AND '.join(conditions)}
+              ORDER BY ts_rank(search_vector, ts.query) + word_similarity(%s, search_text) DESC, id DESC
+              LIMIT %s OFFSET %s"""
+    args = [query['q'], query['q'], *filter_args, search_text, search_text, limit + 1, offset]
+    
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, args)
+            rows = cur.fetchall()
+    
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    
+    with timed('map_rows'):
+        products = [row_to_product(fields, row, query.get('image_width')) for row in rows]
+    return products, next_offset
+
+@retry_stale_connection
+def get_product_by_id(product_id: int) -> Dict[str, Any]:
+    with db_connection(readonly=True) as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """SELECT id, name, category, price, image_url, glow_color, description, created_at
+                """SELECT id, name, category, price, image_url, glow_color, description, created_at,
+                          image_variants, image_placeholder
                    FROM products WHERE id = %s""",
                 (product_id,)
             )
             row = cur.fetchone()
             if not row:
                 return None
+            variants = fresh_image_variants(row[8], row[4])
+            
+            cur.execute(
+                "SELECT image_url FROM product_images WHERE product_id = %s ORDER BY position",
+                (product_id,)
+            )
+            gallery = [image_row[0] for image_row in cur.fetchall()]
             
             return {
                 'id': row[0],
@@ -68,27 +689,144 @@ def get_product_by_id(product_id: int) -> Dict[str, Any]:
                 'image': row[4],
                 'glow': row[5],
                 'description': row[6],
-                'created_at': row[7].isoformat() if row[7] else None
+                'created_at': row[7].isoformat() if row[7] else None,
+                'images': variants,
+                'placeholder': row[9] if variants else None,
+                'gallery': gallery or [row[4]]
             }
-    finally:
-        conn.close()
 
+@retry_stale_connection
+def get_products_by_ids(ids: List[int], fields: Optional[List[str]] = None) -> str:
+    fields = fields or list(PRODUCT_COLUMNS)
+    
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            if CATALOG_JSON_MODE == 'db':
+                cur.execute(
+                    f"SELECT p.id, json_build_object({json_pairs_sql(fields, 'p')})::text FROM products p WHERE p.id = ANY(%s)",
+                    (ids,)
+                )
+                found = dict(cur.fetchall())
+            else:
+                cur.execute(f"SELECT id, {product_select_list(fields, {})} FROM products WHERE id = ANY(%s)", (ids,))
+                rows = cur.fetchall()
+                with timed('serialize'):
+                    found = {row[0]: dumps_json(row_to_product(fields, row[1:])) for row in rows}
+    
+    products = [found[product_id] for product_id in ids if product_id in found]
+    missing = [product_id for product_id in ids if product_id not in found]
+    return f'{{"products": [{", ".join(products)}], "count": {len(products)}, "missing": {json.dumps(missing)}}}'
+
+@retry_stale_connection
+def get_product_json(product_id: int) -> Optional[str]:
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT json_build_object(
+                           {json_pairs_sql(list(PRODUCT_COLUMNS), 'p')},
+                           'gallery', COALESCE(
+                               (SELECT json_agg(pi.image_url ORDER BY pi.position) FROM product_images pi WHERE pi.product_id = p.id),
+                               json_build_array(p.image_url)
+                           )
+                       )::text
+                   FROM products p WHERE p.id = %s""",
+                (product_id,)
+            )
+            row = cur.fetchone()
+    return row[0] if row else None
+
+def render_product(product_id: int) -> Optional[str]:
+    if CATALOG_JSON_MODE == 'db':
+        return get_product_json(product_id)
+    product = get_product_by_id(product_id)
+    if not product:
+        return None
+    with timed('serialize'):
+        return dumps_json(product)
+
+def render_catalog(query: Dict[str, Any]) -> str:
+    if 'q' in query:
+        products, next_offset = search_products(query)
+        with timed('serialize'):
+            return dumps_json({
+                'products': products,
+                'count': len(products),
+                'next_offset': next_offset
+            })
+    
+    if CATALOG_JSON_MODE == 'db' and not query.get('image_width'):
+        return get_all_products_json(query)
+    
+    products, next_cursor = get_all_products(query)
+    with timed('serialize'):
+        return dumps_json({
+            'products': products,
+            'count': len(products),
+            'next_cursor': next_cursor
+        })
+
+@retry_stale_connection
+def get_catalog_version() -> Optional[int]:
+    now = time.monotonic()
+    if not reads_pinned() and now - _catalog_version['checked_at'] < CATALOG_VERSION_CHECK_INTERVAL:
+        return _catalog_version['value']
+    
+    with db_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM cache_versions WHERE name = 'catalog'")
+            row = cur.fetchone()
+    
+    _catalog_version['value'] = row[0] if row else None
+    _catalog_version['checked_at'] = now
+    return _catalog_version['value']
+
+def get_cached_catalog(query: Dict[str, Any]) -> Dict[str, Any]:
+    cache_key = json.dumps(query, sort_keys=True)
+    now = time.monotonic()
+    version = get_catalog_version()
+    entry = _catalog_cache.get(cache_key)
+    if entry and entry['expires_at'] > now and entry['version'] == version:
+        _catalog_cache[cache_key] = _catalog_cache.pop(cache_key)
+        return entry
+    
+    body = render_catalog(query)
+    entry = {
+        'body': body,
+        'etag': '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"',
+        'expires_at': now + CATALOG_CACHE_TTL,
+        'version': version
+    }
+    
+    _catalog_cache.pop(cache_key, None)
+    while len(_catalog_cache) >= CATALOG_CACHE_MAX_ENTRIES:
+        _catalog_cache.pop(next(iter(_catalog_cache)))
+    _catalog_cache[cache_key] = entry
+    return entry
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+@instrumented('products-api')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
+    headers = event.get('headers', {}) or {}
     
     if method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, X-Last-Write',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    if method != 'GET':
+    if method not in ('GET', 'POST'):
         return {
             'statusCode': 405,
             'headers': {
@@ -98,14 +836,47 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
+    pinned = pin_reads_to_primary(headers)
+    
     try:
         params = event.get('queryStringParameters', {}) or {}
         product_id = params.get('id')
-        category = params.get('category')
+        
+        if method == 'POST' or params.get('ids'):
+            try:
+                if method == 'POST':
+                    payload = json.loads(event.get('body') or '{}')
+                    if not isinstance(payload, dict):
+                        raise ValueError('Body must be a JSON object')
+                    ids = parse_product_ids(payload.get('ids'))
+                    fields = parse_fields(payload['fields']) if payload.get('fields') else None
+                else:
+                    ids = parse_product_ids(params['ids'])
+                    fields = parse_fields(params['fields']) if params.get('fields') else None
+            except (ValueError, TypeError) as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Cache-Control': f'public, max-age={CATALOG_CACHE_MAX_AGE}' if method == 'GET' and not pinned else 'private, no-store',
+                    'Vary': 'X-Last-Write',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': get_products_by_ids(ids, fields)
+            }
         
         if product_id:
-            product = get_product_by_id(int(product_id))
-            if not product:
+            body = render_product(int(product_id))
+            if body is None:
                 return {
                     'statusCode': 404,
                     'headers': {
@@ -121,21 +892,47 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps(product)
+                'body': body
+            }
+        
+        try:
+            query = parse_catalog_query(params)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': str(e)})
             }
         
-        products = get_all_products(category)
+        catalog = get_cached_catalog(query)
+        cache_headers = {
+            'ETag': catalog['etag'],
+            'Cache-Control': 'private, no-store' if pinned else (
+                f'public, max-age={CATALOG_CACHE_MAX_AGE}, '
+                f'stale-while-revalidate={CATALOG_CACHE_STALE_WHILE_REVALIDATE}'
+            ),
+            'Vary': 'X-Last-Write',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag'
+        }
+        
+        if etag_matches(headers.get('If-None-Match') or headers.get('if-none-match'), catalog['etag']):
+            return {
+                'statusCode': 304,
+                'headers': cache_headers,
+                'body': ''
+            }
         
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                **cache_headers
             },
-            'body': json.dumps({
-                'products': products,
-                'count': len(products)
-            })
+            'body': catalog['body']
         }
     
     except Exception as e:
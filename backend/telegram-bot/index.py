@@ -1,21 +1,448 @@
 '''
 Business: Telegram бот для автоматической публикации товаров, фото и видео на сайт
-Args: event - dict с httpMethod, body от Telegram webhook
+Args: event - dict с httpMethod, body от Telegram webhook (ставится в очередь telegram_updates);
+             GET ?action=process-queue или точка входа worker обрабатывают очередь,
+             GET ?action=reingest-files[&after=<last_id>] переносит старые файлы Telegram в хранилище
+             порциями, last_id из ответа продолжает проход мимо файлов, которые не удалось скачать,
+             GET ?action=archive-messages или точка входа archive_worker выгружают старые
+             месячные партиции telegram_messages (без номеров телефонов) в закрытый бакет
+             MESSAGES_ARCHIVE_BUCKET и удаляют их; без этого бакета архивация не запускается
       context - object с request_id, function_name
 Returns: HTTP response для Telegram
 '''
 
+import base64
+import contextvars
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
 import json
+import mimetypes
 import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
 import psycopg2
-from typing import Dict, Any, Optional
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import wraps
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Callable
 from datetime import datetime
 
 ALLOWED_PHONE = "+79222142996"
+ALLOWED_PHONES_ENV = os.environ.get('ALLOWED_PHONES', '')
 
-def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'session')
+DATABASE_READ_URLS = [
+    url.strip()
+    for url in (os.environ.get('DATABASE_READ_URLS') or os.environ.get('DATABASE_READ_URL') or '').split(',')
+    if url.strip()
+]
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+DB_READ_YOUR_WRITES_WINDOW = float(os.environ.get('DB_READ_YOUR_WRITES_WINDOW', '15'))
+
+QUEUE_BATCH_SIZE = int(os.environ.get('QUEUE_BATCH_SIZE', '20'))
+QUEUE_MAX_ATTEMPTS = int(os.environ.get('QUEUE_MAX_ATTEMPTS', '5'))
+QUEUE_BACKOFF_BASE = int(os.environ.get('QUEUE_BACKOFF_BASE', '10'))
+QUEUE_BACKOFF_MAX = int(os.environ.get('QUEUE_BACKOFF_MAX', '3600'))
+QUEUE_LOCK_TIMEOUT = int(os.environ.get('QUEUE_LOCK_TIMEOUT', '300'))
+QUEUE_DRAIN_BUDGET = float(os.environ.get('QUEUE_DRAIN_BUDGET', '25'))
+QUEUE_DONE_RETENTION = int(os.environ.get('QUEUE_DONE_RETENTION', str(48 * 3600)))
+QUEUE_PURGE_BATCH = 5000
+ALBUM_WINDOW = float(os.environ.get('ALBUM_WINDOW', '3'))
+CATALOG_PUBLISH_TIMEOUT = float(os.environ.get('CATALOG_PUBLISH_TIMEOUT', '1'))
+RECENT_UPDATES_WINDOW = int(os.environ.get('RECENT_UPDATES_WINDOW', '2000'))
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', '300'))
+AUTH_NEGATIVE_CACHE_TTL = float(os.environ.get('AUTH_NEGATIVE_CACHE_TTL', '30'))
+
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+TELEGRAM_TIMEOUT = float(os.environ.get('TELEGRAM_TIMEOUT', '5'))
+TELEGRAM_MAX_ATTEMPTS = int(os.environ.get('TELEGRAM_MAX_ATTEMPTS', '3'))
+TELEGRAM_MAX_RETRY_AFTER = float(os.environ.get('TELEGRAM_MAX_RETRY_AFTER', '10'))
+TELEGRAM_POOL_SIZE = int(os.environ.get('TELEGRAM_POOL_SIZE', '4'))
+TELEGRAM_ASYNC_REPLIES = os.environ.get('TELEGRAM_ASYNC_REPLIES', '0') == '1'
+TELEGRAM_FLUSH_TIMEOUT = float(os.environ.get('TELEGRAM_FLUSH_TIMEOUT', '10'))
+TELEGRAM_CHAT_RATE = 1.0
+TELEGRAM_GROUP_RATE = 20 / 60
+TELEGRAM_GLOBAL_RATE = 30.0
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+TELEGRAM_MEDIA_PREFIX = 'media/telegram'
+FILE_CHUNK_SIZE = 1024 * 1024
+FILE_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+FILE_MULTIPART_SIZE = 8 * 1024 * 1024
+MESSAGES_RETENTION_MONTHS = int(os.environ.get('MESSAGES_RETENTION_MONTHS', '6'))
+MESSAGES_PREMAKE_MONTHS = int(os.environ.get('MESSAGES_PREMAKE_MONTHS', '3'))
+MESSAGES_ARCHIVE_BUCKET = os.environ.get('MESSAGES_ARCHIVE_BUCKET', '')
+MESSAGES_ARCHIVE_PREFIX = 'archive/telegram_messages'
+MESSAGES_ARCHIVE_COLUMNS = (
+    'id', 'telegram_user_id', 'message_type', 'message_text', 'file_url', 'file_id', 'created_at', 'processed', 'product_id'
+)
+MESSAGES_ARCHIVE_BATCH = 5000
+VARIANTS_DIR = '_variants'
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_FORMATS = ('webp', 'avif')
+IMAGE_PLACEHOLDER_WIDTH = 16
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESSION_CACHE_MAX_ENTRIES', '256'))
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+
+_db_pool: Optional[ThreadedConnectionPool] = None
+_db_last_used: Dict[int, float] = {}
+_db_statements_run: Dict[int, bool] = {}
+_replica_pools: Dict[str, ThreadedConnectionPool] = {}
+_replica_lag: Dict[str, Dict[str, Any]] = {}
+_replica_turn = itertools.count()
+_read_written_at: contextvars.ContextVar = contextvars.ContextVar('read_written_at', default=0.0)
+_recent_update_ids: 'OrderedDict[int, None]' = OrderedDict()
+_auth_cache: Dict[int, Tuple[Optional[str], float]] = {}
+_s3_client = None
+_transfer_config = None
+_telegram_connections: 'queue.LifoQueue[Any]' = queue.LifoQueue()
+_telegram_buckets: Dict[Any, 'TokenBucket'] = {}
+_telegram_buckets_lock = threading.Lock()
+_telegram_executor: Optional[ThreadPoolExecutor] = None
+_pending_sends: List[Future] = []
+_request_trace: Dict[str, Any] = {'cold_start': True}
+_request_phases: contextvars.ContextVar = contextvars.ContextVar('request_phases', default=None)
+_compressed_bodies: Dict[str, str] = {}
+_brotli: Any = None
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = _request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + (time.perf_counter() - started) * 1000
+
+def should_profile(headers: Dict[str, str]) -> bool:
+    token = headers.get('X-Profile-Token') or headers.get('x-profile-token') or ''
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def log_event(name: str, **fields: Any):
+    print(json.dumps({'event': name, **fields}, default=str))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    
+    for encoding in ('br', 'gzip'):
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or brotli_available()):
+            return encoding
+    return None
+
+def brotli_available() -> bool:
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli is not False
+
+def compress_response(response: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    body = response.get('body') if isinstance(response, dict) else None
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    vary = headers.get('Vary')
+    headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    encoding = negotiate_encoding(request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding') or '')
+    if not encoding:
+        return response
+    
+    etag = headers.get('ETag')
+    cache_key = f'{encoding}:{etag}' if etag else None
+    encoded = _compressed_bodies.pop(cache_key, None) if cache_key else None
+    if encoded is None:
+        with timed('compress'):
+            data = body.encode('utf-8')
+            compressed = _brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+            encoded = base64.b64encode(compressed).decode('ascii')
+    if cache_key:
+        while len(_compressed_bodies) >= COMPRESSION_CACHE_MAX_ENTRIES:
+            _compressed_bodies.pop(next(iter(_compressed_bodies)))
+        _compressed_bodies[cache_key] = encoded
+    
+    response['body'] = encoded
+    response['isBase64Encoded'] = True
+    headers['Content-Encoding'] = encoding
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return response
+
+def instrumented(function_name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            if _request_phases.get() is not None:
+                return func(event, context)
+            
+            phases_token = _request_phases.set({})
+            cold_start = _request_trace['cold_start']
+            _request_trace['cold_start'] = False
+            request_id = getattr(context, 'request_id', None)
+            profiler = None
+            if should_profile(event.get('headers') or {}):
+                import cProfile
+                profiler = cProfile.Profile()
+            response = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    profiler.enable()
+                response = compress_response(func(event, context), event.get('headers') or {})
+                return response
+            finally:
+                if profiler:
+                    profiler.disable()
+                total = (time.perf_counter() - started) * 1000
+                phases = {phase: round(ms, 2) for phase, ms in _request_phases.get().items()}
+                _request_phases.reset(phases_token)
+                
+                if isinstance(response, dict):
+                    response_headers = response.setdefault('headers', {})
+                    response_headers['Server-Timing'] = ', '.join(
+                        [f'{phase};dur={ms}' for phase, ms in phases.items()] + [f'total;dur={total:.2f}']
+                    )
+                    response_headers['Timing-Allow-Origin'] = '*'
+                
+                log_event(
+                    'request',
+                    function=function_name,
+                    request_id=request_id,
+                    method=event.get('httpMethod'),
+                    params=event.get('queryStringParameters') or {},
+                    status=response.get('statusCode') if isinstance(response, dict) else 500,
+                    duration_ms=round(total, 2),
+                    phases=phases,
+                    cold_start=cold_start
+                )
+                if profiler:
+                    import pstats
+                    stream = io.StringIO()
+                    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                    log_event('profile', function=function_name, request_id=request_id, stats=stream.getvalue())
+        return wrapper
+    return decorator
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with timed('db_query'):
+            result = super().execute(query, vars)
+        _db_statements_run[id(self.connection)] = True
+        return result
+    
+    def executemany(self, query, vars_list):
+        with timed('db_query'):
+            result = super().executemany(query, vars_list)
+        _db_statements_run[id(self.connection)] = True
+        return result
+
+class StaleConnectionError(psycopg2.OperationalError):
+    pass
+
+def retry_stale_connection(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except StaleConnectionError as e:
+            log_event('db_stale_connection_retry', function=func.__name__, error=str(e))
+            return func(*args, **kwargs)
+    return wrapper
+
+def get_db_pool() -> ThreadedConnectionPool:
+    global _db_pool
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            os.environ.get('DATABASE_URL'),
+            cursor_factory=TimedCursor,
+            connect_timeout=5,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+    return _db_pool
+
+def get_replica_pool(dsn: str) -> ThreadedConnectionPool:
+    db_pool = _replica_pools.get(dsn)
+    if db_pool is None or db_pool.closed:
+        db_pool = ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            dsn,
+            cursor_factory=TimedCursor,
+            connect_timeout=2,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+        _replica_pools[dsn] = db_pool
+    return db_pool
+
+def is_connection_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def release_connection(db_pool: ThreadedConnectionPool, conn, broken: bool = False):
+    if not broken and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    if broken or conn.closed:
+        _db_last_used.pop(id(conn), None)
+        _db_statements_run.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+    else:
+        _db_last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+
+def acquire_connection(db_pool: ThreadedConnectionPool):
+    for _ in range(DB_POOL_MAX):
+        conn = db_pool.getconn()
+        if is_connection_alive(conn):
+            break
+        release_connection(db_pool, conn, broken=True)
+    else:
+        conn = db_pool.getconn()
+    _db_statements_run.pop(id(conn), None)
+    return conn
+
+def measure_replica_lag(dsn: str) -> Optional[float]:
+    try:
+        db_pool = get_replica_pool(dsn)
+        conn = acquire_connection(db_pool)
+    except psycopg2.Error:
+        return None
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                          END"""
+            )
+            return float(cur.fetchone()[0])
+    except psycopg2.Error:
+        broken = True
+        return None
+    finally:
+        release_connection(db_pool, conn, broken)
+
+def replica_is_fresh(dsn: str) -> bool:
+    state = _replica_lag.setdefault(dsn, {'lag': None, 'checked_at': 0.0})
+    now = time.monotonic()
+    if now - state['checked_at'] >= DB_REPLICA_CHECK_INTERVAL:
+        state['checked_at'] = now
+        state['lag'] = measure_replica_lag(dsn)
+        if state['lag'] is None or state['lag'] > DB_REPLICA_MAX_LAG:
+            log_event('replica_skipped', replica=DATABASE_READ_URLS.index(dsn), lag=state['lag'])
+    return state['lag'] is not None and state['lag'] <= DB_REPLICA_MAX_LAG
+
+def choose_replica() -> Optional[str]:
+    if not DATABASE_READ_URLS or reads_pinned():
+        return None
+    for _ in DATABASE_READ_URLS:
+        dsn = DATABASE_READ_URLS[next(_replica_turn) % len(DATABASE_READ_URLS)]
+        if replica_is_fresh(dsn):
+            return dsn
+    return None
+
+def reads_pinned() -> bool:
+    return abs(time.time() - _read_written_at.get()) < DB_READ_YOUR_WRITES_WINDOW
+
+def pin_reads_to_primary(headers: Dict[str, str]) -> bool:
+    '''Запоминает X-Last-Write в контексте запроса: свежая запись клиента читается с primary, а не с отстающей реплики'''
+    last_write = headers.get('X-Last-Write') or headers.get('x-last-write') or ''
+    try:
+        written_at = int(last_write) / 1000
+    except ValueError:
+        written_at = 0.0
+    _read_written_at.set(written_at)
+    return reads_pinned()
+
+@contextmanager
+def db_connection(readonly: bool = False) -> Iterator[Any]:
+    replica = choose_replica() if readonly else None
+    with timed('db_connect'):
+        db_pool = get_db_pool()
+        if replica:
+            try:
+                db_pool = get_replica_pool(replica)
+                conn = acquire_connection(db_pool)
+            except psycopg2.OperationalError:
+                _replica_lag[replica]['lag'] = None
+                replica, db_pool = None, get_db_pool()
+        if not replica:
+            conn = acquire_connection(db_pool)
+    broken = False
+    try:
+        if DB_POOL_MODE == 'transaction':
+            with conn:
+                yield conn
+        else:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        if replica:
+            _replica_lag[replica]['lag'] = None
+        if conn.closed:
+            _db_last_used.clear()
+            if not _db_statements_run.get(id(conn)):
+                raise StaleConnectionError(str(e).strip()) from e
+        raise
+    finally:
+        release_connection(db_pool, conn, broken)
 
 def verify_admin_token(headers: Dict[str, str]) -> bool:
     admin_token = os.environ.get('ADMIN_TOKEN')
@@ -25,30 +452,416 @@ def verify_admin_token(headers: Dict[str, str]) -> bool:
     provided_token = headers.get('X-Admin-Token') or headers.get('x-admin-token')
     return provided_token == admin_token
 
-def is_authorized_user(telegram_user_id: int, phone: Optional[str] = None) -> bool:
-    if phone and phone.replace('-', '').replace(' ', '') == ALLOWED_PHONE.replace('-', '').replace(' ', ''):
-        return True
-    
-    conn = get_db_connection()
-    try:
+def normalize_phone(phone: str) -> str:
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    return '+' + digits
+
+ALLOWED_PHONES = frozenset(
+    normalize_phone(phone)
+    for phone in [ALLOWED_PHONE, *ALLOWED_PHONES_ENV.split(',')]
+    if phone.strip()
+)
+
+def is_allowed_phone(phone: Optional[str]) -> bool:
+    return bool(phone) and normalize_phone(phone) in ALLOWED_PHONES
+
+def authorize_user(telegram_user_id: int, phone: str):
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO authorized_telegram_users (telegram_user_id, phone_number)
+                   VALUES (%s, %s)
+                   ON CONFLICT (telegram_user_id) DO UPDATE
+                   SET phone_number = EXCLUDED.phone_number, authorized_at = CURRENT_TIMESTAMP""",
+                (telegram_user_id, normalize_phone(phone))
+            )
+            conn.commit()
+    _auth_cache[telegram_user_id] = (normalize_phone(phone), time.monotonic() + AUTH_CACHE_TTL)
+
+@retry_stale_connection
+def fetch_authorized_phone(telegram_user_id: int, readonly: bool) -> Optional[Tuple]:
+    with db_connection(readonly=readonly) as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT COUNT(*) FROM telegram_messages WHERE telegram_user_id = %s AND phone_number = %s",
-                (telegram_user_id, ALLOWED_PHONE)
+                "SELECT phone_number FROM authorized_telegram_users WHERE telegram_user_id = %s",
+                (telegram_user_id,)
             )
-            result = cur.fetchone()
-            return result[0] > 0
+            return cur.fetchone()
+
+def get_authorized_phone(telegram_user_id: int) -> Optional[str]:
+    cached = _auth_cache.get(telegram_user_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    row = fetch_authorized_phone(telegram_user_id, readonly=True)
+    if not row and DATABASE_READ_URLS:
+        row = fetch_authorized_phone(telegram_user_id, readonly=False)
+    
+    phone = row[0] if row and is_allowed_phone(row[0]) else None
+    ttl = AUTH_CACHE_TTL if phone else AUTH_NEGATIVE_CACHE_TTL
+    _auth_cache[telegram_user_id] = (phone, time.monotonic() + ttl)
+    return phone
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+        )
+    return _s3_client
+
+def get_cdn_base_url() -> str:
+    return os.environ.get('CDN_BASE_URL') or f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket"
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+def get_rate_bucket(key: Any) -> TokenBucket:
+    with _telegram_buckets_lock:
+        bucket = _telegram_buckets.get(key)
+        if bucket is None:
+            if key == 'global':
+                bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+            elif isinstance(key, int) and key < 0:
+                bucket = TokenBucket(TELEGRAM_GROUP_RATE, 1)
+            else:
+                bucket = TokenBucket(TELEGRAM_CHAT_RATE, 1)
+            _telegram_buckets[key] = bucket
+        return bucket
+
+def new_telegram_connection() -> Any:
+    import http.client
+    parts = urllib.parse.urlsplit(TELEGRAM_API_BASE)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(parts.netloc, timeout=TELEGRAM_TIMEOUT)
+
+@contextmanager
+def telegram_connection() -> Iterator[Any]:
+    try:
+        conn = _telegram_connections.get_nowait()
+    except queue.Empty:
+        conn = new_telegram_connection()
+    reusable = False
+    try:
+        yield conn
+        reusable = True
     finally:
-        conn.close()
+        if reusable and _telegram_connections.qsize() < TELEGRAM_POOL_SIZE:
+            _telegram_connections.put(conn)
+        else:
+            conn.close()
+
+def telegram_api_request(method: str, params: Dict[str, Any], bot_token: str) -> Any:
+    from http.client import HTTPException
+    path = f"{urllib.parse.urlsplit(TELEGRAM_API_BASE).path}/bot{bot_token}/{method}"
+    body = urllib.parse.urlencode(params).encode('utf-8')
+    
+    for attempt in range(1, TELEGRAM_MAX_ATTEMPTS + 1):
+        try:
+            with timed('telegram_api'), telegram_connection() as conn:
+                conn.request('POST', path, body=body, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+                response = conn.getresponse()
+                status = response.status
+                payload = json.loads(response.read() or b'{}')
+        except (HTTPException, OSError, ValueError):
+            if attempt == TELEGRAM_MAX_ATTEMPTS:
+                raise
+            time.sleep(0.2 * attempt)
+            continue
+        
+        if status == 429:
+            retry_after = payload.get('parameters', {}).get('retry_after', 1)
+            if attempt < TELEGRAM_MAX_ATTEMPTS and retry_after <= TELEGRAM_MAX_RETRY_AFTER:
+                time.sleep(retry_after)
+                continue
+        elif status >= 500 and attempt < TELEGRAM_MAX_ATTEMPTS:
+            time.sleep(0.5 * 2 ** (attempt - 1))
+            continue
+        
+        if not payload.get('ok'):
+            raise RuntimeError(f"{method} failed ({status}): {payload.get('description', 'unknown error')}")
+        return payload.get('result')
+
+def iter_telegram_file(file_path: str, bot_token: str) -> Iterator[bytes]:
+    with telegram_connection() as conn:
+        with timed('telegram_api'):
+            conn.request('GET', f"{urllib.parse.urlsplit(TELEGRAM_API_BASE).path}/file/bot{bot_token}/{file_path}")
+            response = conn.getresponse()
+        if response.status != 200:
+            response.read()
+            raise RuntimeError(f'File download failed ({response.status})')
+        while True:
+            with timed('telegram_api'):
+                chunk = response.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def get_telegram_file_path(file_id: str, bot_token: str) -> str:
+    return telegram_api_request('getFile', {'file_id': file_id}, bot_token)['file_path']
 
-def save_telegram_message(data: Dict[str, Any]) -> int:
-    conn = get_db_connection()
+def get_transfer_config():
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+        _transfer_config = TransferConfig(multipart_threshold=FILE_MULTIPART_SIZE, multipart_chunksize=FILE_MULTIPART_SIZE)
+    return _transfer_config
+
+def get_object_metadata(key: str) -> Optional[Dict[str, str]]:
+    from botocore.exceptions import ClientError
     try:
+        return get_s3_client().head_object(Bucket=S3_BUCKET, Key=key).get('Metadata', {})
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+def list_image_variants(base_key: str) -> Dict[str, Dict[str, str]]:
+    folder, _, stem = base_key.rpartition('/')
+    prefix = f'{folder}/{VARIANTS_DIR}/{stem}-'
+    base_url = get_cdn_base_url()
+    variants: Dict[str, Dict[str, str]] = {}
+    response = get_s3_client().list_objects_v2(Bucket=S3_BUCKET, Prefix=prefix)
+    for item in response.get('Contents', []):
+        width, _, fmt = item['Key'][len(prefix):].partition('w.')
+        if width.isdigit() and fmt in IMAGE_VARIANT_FORMATS:
+            variants.setdefault(fmt, {})[width] = f"{base_url}/{item['Key']}"
+    return {
+        fmt: dict(sorted(variants[fmt].items(), key=lambda entry: int(entry[0])))
+        for fmt in IMAGE_VARIANT_FORMATS if fmt in variants
+    }
+
+def build_image_variants(source: Any, base_key: str) -> Dict[str, Any]:
+    '''Сохраняет рядом с base_key (media/home/photo) варианты media/home/_variants/photo-640w.webp; source - файловый объект'''
+    from PIL import Image, ImageFilter, ImageOps
+    folder, _, stem = base_key.rpartition('/')
+    s3 = get_s3_client()
+    base_url = get_cdn_base_url()
+    
+    image = ImageOps.exif_transpose(Image.open(source))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    
+    variants: Dict[str, Dict[str, str]] = {}
+    for width in IMAGE_VARIANT_WIDTHS:
+        if width > image.width and width != IMAGE_VARIANT_WIDTHS[0]:
+            break
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        for fmt in IMAGE_VARIANT_FORMATS:
+            buffer = io.BytesIO()
+            try:
+                resized.save(buffer, fmt.upper(), quality=75 if fmt == 'webp' else 55)
+            except (KeyError, OSError):
+                continue
+            key = f'{folder}/{VARIANTS_DIR}/{stem}-{width}w.{fmt}'
+            s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=key,
+                Body=buffer.getvalue(),
+                ContentType=f'image/{fmt}',
+                CacheControl='public, max-age=31536000, immutable'
+            )
+            variants.setdefault(fmt, {})[str(width)] = f'{base_url}/{key}'
+    
+    tiny = image.copy()
+    tiny.thumbnail((IMAGE_PLACEHOLDER_WIDTH, IMAGE_PLACEHOLDER_WIDTH * 4))
+    buffer = io.BytesIO()
+    tiny.filter(ImageFilter.GaussianBlur(1)).save(buffer, 'WEBP', quality=30)
+    placeholder = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    
+    return {'variants': variants, 'placeholder': placeholder}
+
+def ingest_telegram_file(file_id: str, bot_token: str, derive_variants: bool = False) -> Dict[str, Any]:
+    file_path = get_telegram_file_path(file_id, bot_token)
+    extension = os.path.splitext(file_path)[1].lower()
+    digest = hashlib.sha256()
+    
+    with tempfile.SpooledTemporaryFile(max_size=FILE_SPOOL_MAX_SIZE) as spool:
+        for chunk in iter_telegram_file(file_path, bot_token):
+            digest.update(chunk)
+            spool.write(chunk)
+        
+        sha256 = digest.hexdigest()
+        key = f'{TELEGRAM_MEDIA_PREFIX}/{sha256}{extension}'
+        stored: Dict[str, Any] = {'url': f'{get_cdn_base_url()}/{key}', 'key': key, 'sha256': sha256}
+        metadata = get_object_metadata(key)
+        
+        if derive_variants and metadata is not None:
+            variants = list_image_variants(f'{TELEGRAM_MEDIA_PREFIX}/{sha256}')
+            if variants:
+                stored.update({'variants': variants, 'placeholder': metadata.get('placeholder')})
+                return stored
+        
+        if derive_variants:
+            spool.seek(0)
+            with timed('image_variants'):
+                stored.update(build_image_variants(spool, f'{TELEGRAM_MEDIA_PREFIX}/{sha256}'))
+        
+        if metadata is None:
+            spool.seek(0)
+            with timed('s3_upload'):
+                get_s3_client().upload_fileobj(
+                    spool,
+                    S3_BUCKET,
+                    key,
+                    ExtraArgs={
+                        'ContentType': mimetypes.guess_type(file_path)[0] or 'application/octet-stream',
+                        'CacheControl': 'public, max-age=31536000, immutable',
+                        'Metadata': {'placeholder': stored['placeholder']} if stored.get('placeholder') else {}
+                    },
+                    Config=get_transfer_config()
+                )
+    
+    return stored
+
+def reingest_legacy_files(bot_token: str, limit: int = 20, after_id: int = 0) -> Dict[str, int]:
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT id, created_at, file_id, file_url, message_type, product_id FROM telegram_messages
+                   WHERE file_url LIKE 'https://api.telegram.org/file/%%' AND file_id IS NOT NULL AND id > %s
+                   ORDER BY id LIMIT %s""",
+                (after_id, limit)
+            )
+            rows = cur.fetchall()
+    
+    stats = {'reingested': 0, 'failed': 0, 'last_id': rows[-1][0] if rows else None}
+    for message_id, created_at, file_id, legacy_url, message_type, product_id in rows:
+        try:
+            stored = ingest_telegram_file(file_id, bot_token, derive_variants=message_type == 'photo')
+        except Exception as e:
+            log_event('telegram_reingest_failed', message_id=message_id, error=str(e))
+            stats['failed'] += 1
+            continue
+        
+        stored_data = {'file_url': stored['url'], 'image_variants': stored.get('variants')}
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE telegram_messages SET file_url = %s WHERE id = %s AND created_at = %s",
+                    (stored['url'], message_id, created_at)
+                )
+                cur.execute(
+                    """UPDATE products SET image_url = %s,
+                           image_variants = COALESCE(%s, image_variants),
+                           image_placeholder = COALESCE(%s, image_placeholder)
+                       WHERE id = %s AND image_url = %s""",
+                    (stored['url'], image_variants_json(stored_data), stored.get('placeholder'), product_id, legacy_url)
+                )
+                cur.execute(
+                    "UPDATE product_images SET image_url = %s WHERE product_id = %s AND image_url = %s",
+                    (stored['url'], product_id, legacy_url)
+                )
+                conn.commit()
+        stats['reingested'] += 1
+    return stats
+
+def list_expired_message_partitions() -> List[str]:
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT ensure_telegram_messages_partitions(%s)", (MESSAGES_PREMAKE_MONTHS,))
+            cur.execute(
+                """SELECT c.relname FROM pg_inherits i
+                   JOIN pg_class c ON c.oid = i.inhrelid
+                   WHERE i.inhparent = 'telegram_messages'::regclass
+                     AND c.relname ~ '^telegram_messages_p[0-9]{6}$'
+                     AND to_date(right(c.relname, 6), 'YYYYMM') < date_trunc('month', CURRENT_DATE) - make_interval(months => %s)
+                   ORDER BY c.relname""",
+                (MESSAGES_RETENTION_MONTHS,)
+            )
+            partitions = [row[0] for row in cur.fetchall()]
+            conn.commit()
+    return partitions
+
+def get_archive_bucket() -> str:
+    '''Архив содержит переписку клиентов, поэтому пишется только в отдельный закрытый бакет, а не в публичный S3_BUCKET'''
+    if not MESSAGES_ARCHIVE_BUCKET or MESSAGES_ARCHIVE_BUCKET == S3_BUCKET:
+        raise RuntimeError('MESSAGES_ARCHIVE_BUCKET must be set to a private bucket other than S3_BUCKET')
+    return MESSAGES_ARCHIVE_BUCKET
+
+def archive_message_partition(partition: str, bucket: str) -> Dict[str, Any]:
+    from psycopg2 import sql
+    month = partition[-6:]
+    key = f'{MESSAGES_ARCHIVE_PREFIX}/{month[:4]}-{month[4:]}.jsonl.gz'
+    rows = 0
+    
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            cur.execute(sql.SQL('LOCK TABLE {} IN SHARE MODE').format(sql.Identifier(partition)))
+        
+        with tempfile.SpooledTemporaryFile(max_size=FILE_SPOOL_MAX_SIZE) as spool:
+            with gzip.GzipFile(fileobj=spool, mode='wb') as archive:
+                with conn.cursor(name=f'archive_{partition}') as cur:
+                    cur.itersize = MESSAGES_ARCHIVE_BATCH
+                    cur.execute(
+                        sql.SQL('SELECT row_to_json(m)::text FROM (SELECT {} FROM {} ORDER BY id) m').format(
+                            sql.SQL(', ').join(map(sql.Identifier, MESSAGES_ARCHIVE_COLUMNS)),
+                            sql.Identifier(partition)
+                        )
+                    )
+                    for (line,) in cur:
+                        archive.write(line.encode('utf-8') + b'\n')
+                        rows += 1
+            
+            spool.seek(0)
+            with timed('s3_upload'):
+                get_s3_client().upload_fileobj(
+                    spool,
+                    bucket,
+                    key,
+                    ExtraArgs={'ContentType': 'application/gzip', 'Metadata': {'rows': str(rows)}},
+                    Config=get_transfer_config()
+                )
+        
+        uploaded = get_s3_client().head_object(Bucket=bucket, Key=key)
+        if uploaded.get('Metadata', {}).get('rows') != str(rows):
+            raise RuntimeError(f'Archive {key} does not match partition {partition}')
+        
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL('ALTER TABLE telegram_messages DETACH PARTITION {}').format(sql.Identifier(partition)))
+            cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(partition)))
+        conn.commit()
+    
+    return {'partition': partition, 'bucket': bucket, 'key': key, 'rows': rows}
+
+def archive_telegram_messages() -> Dict[str, Any]:
+    bucket = get_archive_bucket()
+    archived = []
+    for partition in list_expired_message_partitions():
+        result = archive_message_partition(partition, bucket)
+        log_event('telegram_messages_archived', **result)
+        archived.append(result)
+    return {'archived': archived, 'rows': sum(result['rows'] for result in archived)}
+
+def save_telegram_message(data: Dict[str, Any]) -> Tuple[int, datetime]:
+    with db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """INSERT INTO telegram_messages 
                    (telegram_user_id, phone_number, message_type, message_text, file_url, file_id)
-                   VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
+                   VALUES (%s, %s, %s, %s, %s, %s) RETURNING id, created_at""",
                 (
                     data['telegram_user_id'],
                     data.get('phone_number'),
@@ -58,77 +871,490 @@ def save_telegram_message(data: Dict[str, Any]) -> int:
                     data.get('file_id')
                 )
             )
-            message_id = cur.fetchone()[0]
+            message_id, created_at = cur.fetchone()
             conn.commit()
-            return message_id
-    finally:
-        conn.close()
+            return message_id, created_at
 
-def create_product_from_message(message_id: int, message_data: Dict[str, Any]) -> Optional[int]:
-    conn = get_db_connection()
-    try:
+def parse_product_text(text: str) -> Dict[str, Any]:
+    lines = text.split('\n')
+    
+    name = lines[0] if len(lines) > 0 else 'Новый товар'
+    price = 0
+    category = 'interior'
+    description = ''
+    
+    for line in lines[1:]:
+        line_lower = line.lower().strip()
+        if 'цена' in line_lower or 'price' in line_lower:
+            try:
+                price = int(''.join(filter(str.isdigit, line)))
+            except:
+                pass
+        elif 'категория' in line_lower or 'category' in line_lower:
+            if 'ландшафт' in line_lower or 'landscape' in line_lower:
+                category = 'landscape'
+        else:
+            description += line + '\n'
+    
+    return {'name': name, 'price': price, 'category': category, 'description': description.strip()}
+
+def image_variants_json(message_data: Dict[str, Any]) -> Optional[str]:
+    if not message_data.get('image_variants'):
+        return None
+    return json.dumps({'source': message_data['file_url'], **message_data['image_variants']})
+
+def create_product_from_message(message_key: Tuple[int, datetime], message_data: Dict[str, Any]) -> Optional[int]:
+    with db_connection() as conn:
         with conn.cursor() as cur:
-            text = message_data.get('message_text', '')
-            lines = text.split('\n')
+            product = parse_product_text(message_data.get('message_text', ''))
+            image_url = message_data.get('file_url', 'https://placehold.co/400x300')
             
-            name = lines[0] if len(lines) > 0 else 'Новый товар'
-            price = 0
-            category = 'interior'
-            description = ''
+            cur.execute(
+                """INSERT INTO products 
+                   (name, category, price, image_url, description, image_variants, image_placeholder)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                (
+                    product['name'],
+                    product['category'],
+                    product['price'],
+                    image_url,
+                    product['description'],
+                    image_variants_json(message_data),
+                    message_data.get('image_placeholder')
+                )
+            )
+            product_id = cur.fetchone()[0]
             
-            for line in lines[1:]:
-                line_lower = line.lower().strip()
-                if 'цена' in line_lower or 'price' in line_lower:
-                    try:
-                        price = int(''.join(filter(str.isdigit, line)))
-                    except:
-                        pass
-                elif 'категория' in line_lower or 'category' in line_lower:
-                    if 'ландшафт' in line_lower or 'landscape' in line_lower:
-                        category = 'landscape'
-                else:
-                    description += line + '\n'
+            cur.execute(
+                "UPDATE telegram_messages SET processed = TRUE, product_id = %s WHERE id = %s AND created_at = %s",
+                (product_id, *message_key)
+            )
             
-            image_url = message_data.get('file_url', 'https://placehold.co/400x300')
+            conn.commit()
+            return product_id
+
+def create_product_from_album(messages: List[Dict[str, Any]]) -> Tuple[int, str]:
+    from psycopg2.extras import execute_values
+    caption = next((data['message_text'] for data in messages if data.get('message_text')), '')
+    product = parse_product_text(caption)
+    media = [data for data in messages if data.get('file_url')]
+    
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            saved = execute_values(
+                cur,
+                """INSERT INTO telegram_messages
+                   (telegram_user_id, phone_number, message_type, message_text, file_url, file_id)
+                   VALUES %s RETURNING id, created_at""",
+                [
+                    (
+                        data['telegram_user_id'],
+                        data.get('phone_number'),
+                        data['message_type'],
+                        data.get('message_text'),
+                        data.get('file_url'),
+                        data.get('file_id')
+                    )
+                    for data in messages
+                ],
+                fetch=True
+            )
             
             cur.execute(
                 """INSERT INTO products 
-                   (name, category, price, image_url, description)
-                   VALUES (%s, %s, %s, %s, %s) RETURNING id""",
-                (name, category, price, image_url, description.strip())
+                   (name, category, price, image_url, description, image_variants, image_placeholder)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                (
+                    product['name'],
+                    product['category'],
+                    product['price'],
+                    media[0]['file_url'] if media else 'https://placehold.co/400x300',
+                    product['description'],
+                    image_variants_json(media[0]) if media else None,
+                    media[0].get('image_placeholder') if media else None
+                )
             )
             product_id = cur.fetchone()[0]
             
+            execute_values(
+                cur,
+                "INSERT INTO product_images (product_id, position, image_url) VALUES %s",
+                [(product_id, position, data['file_url']) for position, data in enumerate(media)]
+            )
             cur.execute(
-                "UPDATE telegram_messages SET processed = TRUE, product_id = %s WHERE id = %s",
-                (product_id, message_id)
+                "UPDATE telegram_messages SET processed = TRUE, product_id = %s WHERE id = ANY(%s) AND created_at = %s",
+                (product_id, [row[0] for row in saved], saved[0][1])
             )
             
             conn.commit()
-            return product_id
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+            return product_id, product['name']
 
 def send_telegram_message(chat_id: int, text: str, bot_token: str):
-    import urllib.request
-    import urllib.parse
-    
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    data = urllib.parse.urlencode({
+    get_rate_bucket(chat_id).acquire()
+    get_rate_bucket('global').acquire()
+    telegram_api_request('sendMessage', {
         'chat_id': chat_id,
         'text': text,
         'parse_mode': 'HTML'
-    }).encode('utf-8')
+    }, bot_token)
+
+def send_telegram_message_safely(chat_id: int, text: str, bot_token: str):
+    try:
+        send_telegram_message(chat_id, text, bot_token)
+    except Exception as e:
+        log_event('telegram_reply_failed', chat_id=chat_id, error=str(e))
+
+def reply(chat_id: int, text: str, bot_token: str):
+    global _telegram_executor
+    if not TELEGRAM_ASYNC_REPLIES:
+        send_telegram_message_safely(chat_id, text, bot_token)
+        return
+    if _telegram_executor is None:
+        _telegram_executor = ThreadPoolExecutor(max_workers=TELEGRAM_POOL_SIZE, thread_name_prefix='telegram-send')
+    _pending_sends.append(_telegram_executor.submit(send_telegram_message_safely, chat_id, text, bot_token))
+
+def flush_telegram_replies():
+    if _pending_sends:
+        wait(_pending_sends, timeout=TELEGRAM_FLUSH_TIMEOUT)
+        _pending_sends.clear()
+
+def notify_catalog_publisher():
+    '''Публикатор публикует снимок внутри своего вызова; запрос ждёт его не дольше CATALOG_PUBLISH_TIMEOUT'''
+    publisher_url = os.environ.get('CATALOG_PUBLISHER_URL')
+    if not publisher_url:
+        return
+    import urllib.request
+    request = urllib.request.Request(
+        publisher_url,
+        data=b'',
+        method='POST',
+        headers={'X-Admin-Token': os.environ.get('ADMIN_TOKEN', '')}
+    )
+    try:
+        urllib.request.urlopen(request, timeout=CATALOG_PUBLISH_TIMEOUT).close()
+    except TimeoutError:
+        pass
+    except Exception as e:
+        log_event('catalog_publish_notify_failed', error=str(e))
+
+def remember_update_id(update_id: int):
+    _recent_update_ids[update_id] = None
+    _recent_update_ids.move_to_end(update_id)
+    while len(_recent_update_ids) > RECENT_UPDATES_WINDOW:
+        _recent_update_ids.popitem(last=False)
+
+def enqueue_update(update: Dict[str, Any]) -> bool:
+    update_id = update.get('update_id')
+    if update_id is not None and update_id in _recent_update_ids:
+        return False
+    
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            media_group_id = update.get('message', {}).get('media_group_id')
+            cur.execute(
+                """INSERT INTO telegram_updates (update_id, payload, media_group_id, run_after)
+                   VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                   ON CONFLICT (update_id) DO NOTHING""",
+                (update_id, json.dumps(update), media_group_id, ALBUM_WINDOW if media_group_id else 0)
+            )
+            inserted = cur.rowcount > 0
+            conn.commit()
     
-    req = urllib.request.Request(url, data=data)
-    urllib.request.urlopen(req)
+    if update_id is not None:
+        remember_update_id(update_id)
+    return inserted
 
+def claim_updates(batch_size: int) -> List[Tuple[int, Dict[str, Any], int, Optional[str]]]:
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE telegram_updates
+                   SET status = 'processing', locked_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                   WHERE id IN (
+                       SELECT id FROM telegram_updates
+                       WHERE (status = 'pending' AND run_after <= CURRENT_TIMESTAMP)
+                          OR (status = 'processing' AND locked_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                       ORDER BY id
+                       LIMIT %s
+                       FOR UPDATE SKIP LOCKED
+                   )
+                   RETURNING id, payload, attempts, media_group_id""",
+                (QUEUE_LOCK_TIMEOUT, batch_size)
+            )
+            rows = cur.fetchall()
+            
+            media_group_ids = list({row[3] for row in rows if row[3]})
+            if media_group_ids:
+                cur.execute(
+                    """UPDATE telegram_updates
+                       SET status = 'processing', locked_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                       WHERE id IN (
+                           SELECT id FROM telegram_updates
+                           WHERE status = 'pending' AND media_group_id = ANY(%s)
+                           FOR UPDATE SKIP LOCKED
+                       )
+                       RETURNING id, payload, attempts, media_group_id""",
+                    (media_group_ids,)
+                )
+                rows.extend(cur.fetchall())
+            
+            conn.commit()
+    return sorted(rows)
+
+def complete_update(queue_id: int):
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE telegram_updates
+                   SET status = 'done', processed_at = CURRENT_TIMESTAMP, last_error = NULL
+                   WHERE id = %s""",
+                (queue_id,)
+            )
+            conn.commit()
+
+def fail_update(queue_id: int, attempts: int, error: str) -> bool:
+    will_retry = attempts < QUEUE_MAX_ATTEMPTS
+    delay = min(QUEUE_BACKOFF_BASE * 2 ** (attempts - 1), QUEUE_BACKOFF_MAX)
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE telegram_updates
+                   SET status = %s, last_error = %s,
+                       run_after = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                   WHERE id = %s""",
+                ('pending' if will_retry else 'failed', error[:2000], delay, queue_id)
+            )
+            conn.commit()
+    return will_retry
+
+def build_message_data(message: Dict[str, Any], phone: str, bot_token: str) -> Dict[str, Any]:
+    message_data = {
+        'telegram_user_id': message['from']['id'],
+        'phone_number': phone,
+        'message_type': 'text',
+        'message_text': message.get('text', message.get('caption', ''))
+    }
+    
+    if 'photo' in message:
+        message_data['message_type'] = 'photo'
+        photos = message['photo']
+        largest_photo = max(photos, key=lambda p: p['file_size'])
+        message_data['file_id'] = largest_photo['file_id']
+    
+    elif 'video' in message:
+        message_data['message_type'] = 'video'
+        message_data['file_id'] = message['video']['file_id']
+    
+    elif 'document' in message:
+        message_data['message_type'] = 'document'
+        message_data['file_id'] = message['document']['file_id']
+    
+    if message_data['message_type'] in ('photo', 'video'):
+        stored = ingest_telegram_file(
+            message_data['file_id'],
+            bot_token,
+            derive_variants=message_data['message_type'] == 'photo'
+        )
+        message_data['file_url'] = stored['url']
+        if stored.get('variants'):
+            message_data['image_variants'] = stored['variants']
+            message_data['image_placeholder'] = stored['placeholder']
+    
+    return message_data
+
+def process_update(update: Dict[str, Any], bot_token: str):
+    message = update['message']
+    chat_id = message['chat']['id']
+    user_id = message['from']['id']
+    
+    if 'contact' in message:
+        phone = normalize_phone(message['contact']['phone_number'])
+        
+        save_telegram_message({
+            'telegram_user_id': user_id,
+            'phone_number': phone,
+            'message_type': 'text',
+            'message_text': 'Shared contact'
+        })
+        
+        if is_allowed_phone(phone) and message['contact'].get('user_id') == user_id:
+            authorize_user(user_id, phone)
+            reply(
+                chat_id,
+                '✅ <b>Доступ разрешен!</b>\n\nТеперь вы можете публиковать товары.\n\n'
+                '<b>Как добавить товар:</b>\n'
+                '1. Отправьте фото товара\n'
+                '2. В описании укажите:\n'
+                '   • Название (первая строка)\n'
+                '   • Цена: 15000\n'
+                '   • Категория: интерьер/ландшафт\n'
+                '   • Описание товара',
+                bot_token
+            )
+        else:
+            reply(
+                chat_id,
+                '❌ <b>Доступ запрещен</b>\n\nВаш номер телефона не авторизован.',
+                bot_token
+            )
+        return
+    
+    authorized_phone = get_authorized_phone(user_id)
+    if not authorized_phone:
+        reply(
+            chat_id,
+            '❌ <b>Доступ запрещен</b>\n\n'
+            'Отправьте ваш контакт для авторизации.\n'
+            f'Разрешенный номер: {ALLOWED_PHONE}',
+            bot_token
+        )
+        return
+    
+    message_data = build_message_data(message, authorized_phone, bot_token)
+    message_key = save_telegram_message(message_data)
+    
+    if message_data['message_type'] in ['photo', 'video']:
+        product_id = create_product_from_message(message_key, message_data)
+        reply(
+            chat_id,
+            f'✅ <b>Товар добавлен!</b>\n\n'
+            f'ID: {product_id}\n'
+            f'Название: {message_data["message_text"].split(chr(10))[0] if message_data["message_text"] else "Новый товар"}\n\n'
+            f'Товар опубликован на сайте.',
+            bot_token
+        )
+    else:
+        reply(
+            chat_id,
+            '📝 <b>Сообщение сохранено</b>\n\n'
+            'Чтобы создать товар, отправьте фото с описанием.',
+            bot_token
+        )
+
+def process_album(updates: List[Dict[str, Any]], bot_token: str):
+    messages = sorted((update['message'] for update in updates), key=lambda message: message['message_id'])
+    chat_id = messages[0]['chat']['id']
+    
+    authorized_phone = get_authorized_phone(messages[0]['from']['id'])
+    if not authorized_phone:
+        reply(
+            chat_id,
+            '❌ <b>Доступ запрещен</b>\n\n'
+            'Отправьте ваш контакт для авторизации.\n'
+            f'Разрешенный номер: {ALLOWED_PHONE}',
+            bot_token
+        )
+        return
+    
+    product_id, name = create_product_from_album(
+        [build_message_data(message, authorized_phone, bot_token) for message in messages]
+    )
+    reply(
+        chat_id,
+        f'✅ <b>Товар добавлен!</b>\n\n'
+        f'ID: {product_id}\n'
+        f'Название: {name}\n'
+        f'Фото в галерее: {len(messages)}\n\n'
+        f'Товар опубликован на сайте.',
+        bot_token
+    )
+
+def process_update_queue(bot_token: str, batch_size: int = QUEUE_BATCH_SIZE) -> Dict[str, int]:
+    claimed = claim_updates(batch_size)
+    stats = {'claimed': len(claimed), 'processed': 0, 'retried': 0, 'failed': 0}
+    jobs: Dict[Any, List[Tuple[int, Dict[str, Any], int]]] = OrderedDict()
+    for queue_id, update, attempts, media_group_id in claimed:
+        jobs.setdefault(media_group_id or f'update:{queue_id}', []).append((queue_id, update, attempts))
+    
+    for key, rows in jobs.items():
+        try:
+            if key.startswith('update:'):
+                process_update(rows[0][1], bot_token)
+            else:
+                process_album([update for _, update, _ in rows], bot_token)
+        except Exception as e:
+            for queue_id, _, attempts in rows:
+                if fail_update(queue_id, attempts, f'{type(e).__name__}: {e}'):
+                    stats['retried'] += 1
+                else:
+                    stats['failed'] += 1
+            continue
+        for queue_id, _, _ in rows:
+            complete_update(queue_id)
+            stats['processed'] += 1
+    return stats
+
+def drain_update_queue(bot_token: str, budget: float = QUEUE_DRAIN_BUDGET) -> Dict[str, int]:
+    deadline = time.monotonic() + budget
+    totals = {'batches': 0, 'claimed': 0, 'processed': 0, 'retried': 0, 'failed': 0}
+    while time.monotonic() < deadline:
+        stats = process_update_queue(bot_token)
+        if not stats['claimed']:
+            break
+        totals['batches'] += 1
+        for name, value in stats.items():
+            totals[name] += value
+    return totals
+
+def purge_done_updates() -> int:
+    '''Telegram перестаёт повторять доставку через сутки, дальше update_id для дедупликации не нужен'''
+    purged = 0
+    while True:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """DELETE FROM telegram_updates
+                       WHERE id IN (
+                           SELECT id FROM telegram_updates
+                           WHERE status = 'done' AND processed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                           LIMIT %s
+                       )""",
+                    (QUEUE_DONE_RETENTION, QUEUE_PURGE_BATCH)
+                )
+                deleted = cur.rowcount
+                conn.commit()
+        purged += deleted
+        if deleted < QUEUE_PURGE_BATCH:
+            return purged
+
+def worker(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Точка входа для триггера по расписанию: разбирает очередь обновлений Telegram и чистит старые done'''
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    if not bot_token:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Bot token not configured'})
+        }
+    
+    try:
+        stats = drain_update_queue(bot_token)
+    finally:
+        flush_telegram_replies()
+    if stats['processed']:
+        notify_catalog_publisher()
+    stats['purged'] = purge_done_updates()
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'ok': True, **stats})
+    }
+
+def archive_worker(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Точка входа для триггера по расписанию: архивирует и удаляет старые партиции telegram_messages'''
+    result = archive_telegram_messages()
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'ok': True, **result})
+    }
+
+@instrumented('telegram-bot')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
-    headers = event.get('headers', {})
+    headers = event.get('headers', {}) or {}
+    params = event.get('queryStringParameters', {}) or {}
+    pin_reads_to_primary(headers)
     
     if method == 'OPTIONS':
         return {
@@ -153,13 +1379,49 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 })
             }
         
+        if params.get('action') == 'reingest-files':
+            try:
+                stats = reingest_legacy_files(os.environ.get('TELEGRAM_BOT_TOKEN', ''), after_id=int(params.get('after') or 0))
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'ok': True, **stats})
+                }
+            except Exception as e:
+                return {
+                    'statusCode': 500,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': str(e)})
+                }
+        
+        if params.get('action') == 'archive-messages':
+            try:
+                return archive_worker(event, context)
+            except Exception as e:
+                return {
+                    'statusCode': 500,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': str(e)})
+                }
+        
+        if params.get('action') == 'process-queue':
+            try:
+                return worker(event, context)
+            except Exception as e:
+                return {
+                    'statusCode': 500,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': str(e)})
+                }
+        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({
                 'status': 'ok',
                 'bot': 'Telegram Bot Active',
-                'allowed_phone': ALLOWED_PHONE
+                'allowed_phone': ALLOWED_PHONE,
+                'allowed_phones': sorted(ALLOWED_PHONES)
             })
         }
     
@@ -171,123 +1433,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-        if not bot_token:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'error': 'Bot token not configured'})
-            }
-        
         update = json.loads(event.get('body', '{}'))
         
-        if 'message' not in update:
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'ok': True})
-            }
-        
-        message = update['message']
-        chat_id = message['chat']['id']
-        user_id = message['from']['id']
-        
-        phone = None
-        if 'contact' in message:
-            phone = message['contact']['phone_number']
-            if not phone.startswith('+'):
-                phone = '+' + phone
-            
-            save_telegram_message({
-                'telegram_user_id': user_id,
-                'phone_number': phone,
-                'message_type': 'text',
-                'message_text': 'Shared contact'
-            })
-            
-            if phone.replace('-', '').replace(' ', '') == ALLOWED_PHONE.replace('-', '').replace(' ', ''):
-                send_telegram_message(
-                    chat_id,
-                    '✅ <b>Доступ разрешен!</b>\n\nТеперь вы можете публиковать товары.\n\n'
-                    '<b>Как добавить товар:</b>\n'
-                    '1. Отправьте фото товара\n'
-                    '2. В описании укажите:\n'
-                    '   • Название (первая строка)\n'
-                    '   • Цена: 15000\n'
-                    '   • Категория: интерьер/ландшафт\n'
-                    '   • Описание товара',
-                    bot_token
-                )
-            else:
-                send_telegram_message(
-                    chat_id,
-                    '❌ <b>Доступ запрещен</b>\n\nВаш номер телефона не авторизован.',
-                    bot_token
-                )
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'ok': True})
-            }
-        
-        if not is_authorized_user(user_id, phone):
-            send_telegram_message(
-                chat_id,
-                '❌ <b>Доступ запрещен</b>\n\n'
-                'Отправьте ваш контакт для авторизации.\n'
-                f'Разрешенный номер: {ALLOWED_PHONE}',
-                bot_token
-            )
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'ok': True})
-            }
-        
-        message_data = {
-            'telegram_user_id': user_id,
-            'phone_number': ALLOWED_PHONE,
-            'message_type': 'text',
-            'message_text': message.get('text', message.get('caption', ''))
-        }
-        
-        if 'photo' in message:
-            message_data['message_type'] = 'photo'
-            photos = message['photo']
-            largest_photo = max(photos, key=lambda p: p['file_size'])
-            message_data['file_id'] = largest_photo['file_id']
-            message_data['file_url'] = f"https://api.telegram.org/file/bot{bot_token}/{largest_photo['file_id']}"
-        
-        elif 'video' in message:
-            message_data['message_type'] = 'video'
-            message_data['file_id'] = message['video']['file_id']
-            message_data['file_url'] = f"https://api.telegram.org/file/bot{bot_token}/{message['video']['file_id']}"
-        
-        elif 'document' in message:
-            message_data['message_type'] = 'document'
-            message_data['file_id'] = message['document']['file_id']
-            message_data['file_url'] = f"https://api.telegram.org/file/bot{bot_token}/{message['document']['file_id']}"
-        
-        message_id = save_telegram_message(message_data)
-        
-        if message_data['message_type'] in ['photo', 'video']:
-            product_id = create_product_from_message(message_id, message_data)
-            send_telegram_message(
-                chat_id,
-                f'✅ <b>Товар добавлен!</b>\n\n'
-                f'ID: {product_id}\n'
-                f'Название: {message_data["message_text"].split(chr(10))[0] if message_data["message_text"] else "Новый товар"}\n\n'
-                f'Товар опубликован на сайте.',
-                bot_token
-            )
-        else:
-            send_telegram_message(
-                chat_id,
-                '📝 <b>Сообщение сохранено</b>\n\n'
-                'Чтобы создать товар, отправьте фото с описанием.',
-                bot_token
-            )
+        if 'message' in update:
+            enqueue_update(update)
         
         return {
             'statusCode': 200,
@@ -300,4 +1449,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
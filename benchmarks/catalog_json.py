@@ -0,0 +1,89 @@
+'''
+Business: Сравнение путей сериализации каталога products-api: Python + json, Python + orjson и JSON из Postgres
+Args: --database-url (или BENCH_DATABASE_URL) - отдельная локальная база, будет перезаполнена
+      --sizes - размеры каталога через запятую, --iterations - повторов на сценарий
+Returns: таблица p50/p95 в миллисекундах и размер ответа для каждого пути
+'''
+
+import argparse
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from run import BENCH_ENV, DEFAULT_SIZES, apply_migrations, close_handler_module, load_handler_module, percentile, seed_catalog
+
+SCENARIOS = {
+    'full catalog': {},
+    'page of 100 cards': {'limit': '100', 'fields': 'id,name,price,image'},
+    'page of 12': {'limit': '12'}
+}
+
+def measure(render: Callable[[], str], iterations: int) -> Dict[str, Any]:
+    body = render()
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        render()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {'p50': round(percentile(latencies, 50), 2), 'p95': round(percentile(latencies, 95), 2), 'bytes': len(body.encode('utf-8'))}
+
+def python_json(module) -> Callable[[Dict[str, Any]], str]:
+    def render(query: Dict[str, Any]) -> str:
+        module.CATALOG_JSON_MODE, module.orjson = 'python', None
+        return module.render_catalog(query)
+    return render
+
+def python_orjson(module, orjson) -> Callable[[Dict[str, Any]], str]:
+    def render(query: Dict[str, Any]) -> str:
+        module.CATALOG_JSON_MODE, module.orjson = 'python', orjson
+        return module.render_catalog(query)
+    return render
+
+def database_json(module) -> Callable[[Dict[str, Any]], str]:
+    def render(query: Dict[str, Any]) -> str:
+        module.CATALOG_JSON_MODE = 'db'
+        return module.render_catalog(query)
+    return render
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Compare catalog serialization paths of products-api')
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--sizes', default=DEFAULT_SIZES)
+    parser.add_argument('--iterations', type=int, default=30)
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        print('BENCH_DATABASE_URL or --database-url is required', file=sys.stderr)
+        return 2
+
+    os.environ.update(BENCH_ENV)
+    os.environ['DATABASE_URL'] = args.database_url
+
+    import psycopg2
+    for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+        conn = psycopg2.connect(args.database_url)
+        try:
+            apply_migrations(conn)
+            seed_catalog(conn, size)
+        finally:
+            conn.close()
+
+        module = load_handler_module('products-api')
+        paths = {'python + json': python_json(module), 'database json': database_json(module)}
+        if module.orjson is not None:
+            paths['python + orjson'] = python_orjson(module, module.orjson)
+        try:
+            print(f'\n== catalog size {size}')
+            print(f"{'scenario':<20} {'path':<16} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>12}")
+            for scenario, params in SCENARIOS.items():
+                query = module.parse_catalog_query(params)
+                for path, render in paths.items():
+                    result = measure(lambda: render(query), args.iterations)
+                    print(f"{scenario:<20} {path:<16} {result['p50']:>9} {result['p95']:>9} {result['bytes']:>12}")
+        finally:
+            close_handler_module(module)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,124 @@
+'''
+Business: Замер холодного старта облачных функций backend/*/index.py в отдельных процессах
+Args: --runs - число холодных запусков на функцию, --functions, --top - сколько импортов показать
+      --profile - вывести разбор -X importtime по самым дорогим модулям
+      --budget-ms - общий бюджет на импорт модуля вместо COLD_START_BUDGETS_MS
+Returns: медианы времени импорта index и первого запроса (OPTIONS); код выхода 1 при превышении бюджета
+         или если для функции не задан бюджет
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / 'backend'
+
+COLD_START_BUDGETS_MS = {
+    'products-api': 120,
+    'admin-products': 150,
+    'admin-settings': 120,
+    'media-list': 60,
+    'telegram-bot': 150,
+    'catalog-publisher': 120,
+    'home-api': 120
+}
+
+PROBE = '''
+import json, sys, time, types
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS', 'headers': {}, 'queryStringParameters': {}}, types.SimpleNamespace(request_id='coldstart'))
+finished = time.perf_counter()
+sys.stdout.write(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': (finished - imported) * 1000}))
+'''
+
+def discover_functions() -> List[str]:
+    return sorted(path.parent.name for path in BACKEND_DIR.glob('*/index.py'))
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        imports.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+def direct_imports(imports: List[Tuple[str, int, int]]) -> List[Tuple[str, int]]:
+    '''Модули, которые index импортирует сам: importtime печатает дочерние импорты перед родителем'''
+    position = next((i for i, entry in enumerate(imports) if entry[0] == 'index'), None)
+    if position is None:
+        return []
+    children = []
+    for name, _, cumulative in reversed(imports[:position]):
+        if not name.startswith(' '):
+            break
+        if not name.startswith('   '):
+            children.append((name.strip(), cumulative))
+    return children
+
+def cold_start(name: str) -> Dict[str, Any]:
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1', 'PROFILE_SAMPLE_RATE': '0'}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=BACKEND_DIR / name,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['direct_imports'] = direct_imports(parse_importtime(result.stderr))
+    return timings
+
+def summarize(name: str, runs: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+    heaviest: Dict[str, List[int]] = {}
+    for run in runs:
+        for module, cumulative in run['direct_imports']:
+            heaviest.setdefault(module, []).append(cumulative)
+    ranked = sorted(((module, statistics.median(values) / 1000) for module, values in heaviest.items()), key=lambda item: -item[1])
+    return {
+        'function': name,
+        'runs': len(runs),
+        'import_ms': round(statistics.median(run['import_ms'] for run in runs), 2),
+        'first_request_ms': round(statistics.median(run['first_request_ms'] for run in runs), 2),
+        'top_imports': [(module, round(ms, 2)) for module, ms in ranked[:top]]
+    }
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Measure cold start of backend handlers')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--functions', default=','.join(discover_functions()))
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--budget-ms', type=float)
+    return parser.parse_args(argv)
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    failed = False
+    print(f"{'function':<18} {'import ms':>10} {'first req ms':>13} {'budget':>8}  status")
+    for name in [name.strip() for name in args.functions.split(',') if name.strip()]:
+        summary = summarize(name, [cold_start(name) for _ in range(args.runs)], args.top)
+        budget: Optional[float] = args.budget_ms or COLD_START_BUDGETS_MS.get(name)
+        over = budget is not None and summary['import_ms'] > budget
+        failed = failed or over or budget is None
+        status = 'no budget' if budget is None else 'FAIL' if over else 'ok'
+        print(
+            f"{name:<18} {summary['import_ms']:>10} {summary['first_request_ms']:>13} "
+            f"{budget if budget is not None else '-':>8}  {status}"
+        )
+        if args.profile:
+            for module, ms in summary['top_imports']:
+                print(f"    {module:<40} {ms:>8} ms")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+'''
+Business: Проверка маршрутизации чтений products-api между основной базой и репликами
+Args: --primary-url (или BENCH_DATABASE_URL) и --replica-url (или BENCH_REPLICA_URL) - две локальные базы Postgres,
+      обе будут перезаполнены каталогами разного размера
+Returns: таблица сценариев с ожидаемой и фактической базой; код выхода 1, если чтение ушло не туда
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from run import BENCH_ENV, COLD_CACHE_ENV, apply_migrations, close_handler_module, load_handler_module, seed_catalog
+
+PRIMARY_SIZE = 10
+REPLICA_SIZE = 20
+UNREACHABLE_URL = 'postgresql://127.0.0.1:9/unreachable'
+
+def seed(url: str, size: int):
+    import psycopg2
+    conn = psycopg2.connect(url)
+    try:
+        apply_migrations(conn)
+        seed_catalog(conn, size)
+    finally:
+        conn.close()
+
+def catalog_size(module, headers: Dict[str, str]) -> int:
+    event = {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {}, 'path': '/'}
+    response = module.handler(event, SimpleNamespace(request_id='replicas', function_name='products-api'))
+    return json.loads(response['body'])['count']
+
+def run_case(name: str, read_urls: str, headers: Dict[str, str], expected: int, max_lag: str = '5') -> Dict[str, Any]:
+    os.environ['DATABASE_READ_URLS'] = read_urls
+    os.environ['DB_REPLICA_MAX_LAG'] = max_lag
+    module = load_handler_module('products-api')
+    try:
+        actual = catalog_size(module, headers)
+    finally:
+        close_handler_module(module)
+    return {'case': name, 'expected': expected, 'actual': actual}
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Check read routing of products-api between primary and replicas')
+    parser.add_argument('--primary-url', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--replica-url', default=os.environ.get('BENCH_REPLICA_URL'))
+    args = parser.parse_args(argv)
+    if not args.primary_url or not args.replica_url:
+        print('--primary-url and --replica-url (or BENCH_DATABASE_URL and BENCH_REPLICA_URL) are required', file=sys.stderr)
+        return 2
+
+    os.environ.update(BENCH_ENV)
+    os.environ.update(COLD_CACHE_ENV)
+    os.environ['DATABASE_URL'] = args.primary_url
+    seed(args.primary_url, PRIMARY_SIZE)
+    seed(args.replica_url, REPLICA_SIZE)
+
+    just_written = {'X-Last-Write': str(int(time.time() * 1000))}
+    results = [
+        run_case('no replicas configured', '', {}, PRIMARY_SIZE),
+        run_case('read goes to replica', args.replica_url, {}, REPLICA_SIZE),
+        run_case('pinned after admin write', args.replica_url, just_written, PRIMARY_SIZE),
+        run_case('replica lag over limit', args.replica_url, {}, PRIMARY_SIZE, max_lag='-1'),
+        run_case('replica unreachable', UNREACHABLE_URL, {}, PRIMARY_SIZE),
+        run_case('unreachable replica skipped', f'{UNREACHABLE_URL},{args.replica_url}', {}, REPLICA_SIZE)
+    ]
+
+    failed = False
+    print(f"{'case':<32} {'expected':<10} {'actual':<10} status")
+    for result in results:
+        ok = result['expected'] == result['actual']
+        failed = failed or not ok
+        source = {PRIMARY_SIZE: 'primary', REPLICA_SIZE: 'replica'}
+        print(
+            f"{result['case']:<32} {source.get(result['expected'], '?'):<10} "
+            f"{source.get(result['actual'], result['actual']):<10} {'ok' if ok else 'FAIL'}"
+        )
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
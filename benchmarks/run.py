@@ -0,0 +1,284 @@
+'''
+Business: Нагрузочный прогон облачных функций backend/*/index.py по сценариям из tests.json
+Args: --database-url (или BENCH_DATABASE_URL) - отдельная локальная база Postgres, она будет перезаполнена
+      --sizes - размеры каталога через запятую, --concurrency, --requests, --functions
+      --s3-endpoint - MinIO вместо moto, --cold-cache - отключить in-memory кэши функций
+      --report - путь для JSON-отчёта
+Returns: таблица throughput и p50/p95/p99 по каждому сценарию; код выхода 1,
+         если ответы не совпали с expectedStatus или нарушен latencyBudgetMs из tests.json
+'''
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / 'backend'
+MIGRATIONS_DIR = ROOT / 'db_migrations'
+DB_FUNCTIONS = ('products-api', 'admin-products', 'admin-settings', 'telegram-bot', 'home-api')
+S3_FUNCTIONS = ('media-list', 'home-api')
+DEFAULT_SIZES = '1000,10000,100000'
+MOTO_ENDPOINT = 'https://s3.us-east-1.amazonaws.com'
+
+BENCH_ENV = {
+    'ADMIN_TOKEN': 'bench-admin-token',
+    'TELEGRAM_BOT_TOKEN': 'bench-bot-token',
+    'TELEGRAM_API_BASE': 'http://127.0.0.1:9',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'S3_BUCKET': 'files',
+    'CDN_BASE_URL': 'https://cdn.example.test/bucket',
+    'IMAGE_DERIVATIVES_ON_WRITE': '0',
+    'PROFILE_SAMPLE_RATE': '0'
+}
+COLD_CACHE_ENV = {
+    'CATALOG_CACHE_TTL': '0',
+    'CATALOG_VERSION_CHECK_INTERVAL': '0',
+    'SETTINGS_VERSION_CHECK_INTERVAL': '0',
+    'MEDIA_CACHE_TTL': '0'
+}
+
+def discover_functions() -> List[str]:
+    return sorted(path.parent.name for path in BACKEND_DIR.glob('*/index.py'))
+
+def load_handler_module(name: str) -> ModuleType:
+    module_name = f"bench_{name.replace('-', '_')}_{uuid.uuid4().hex[:8]}"
+    spec = importlib.util.spec_from_file_location(module_name, BACKEND_DIR / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def close_handler_module(module: ModuleType):
+    pools = [getattr(module, '_db_pool', None), *getattr(module, '_replica_pools', {}).values()]
+    for db_pool in pools:
+        if db_pool is not None and not db_pool.closed:
+            db_pool.closeall()
+
+def load_scenarios(name: str) -> List[Dict[str, Any]]:
+    tests_path = BACKEND_DIR / name / 'tests.json'
+    if not tests_path.exists():
+        return []
+    return json.loads(tests_path.read_text(encoding='utf-8')).get('tests', [])
+
+def build_event(test: Dict[str, Any]) -> Dict[str, Any]:
+    url = urlsplit(test.get('path', '/'))
+    body = test.get('body')
+    headers = {'Content-Type': 'application/json', **test.get('headers', {})}
+    if test.get('auth') == 'admin':
+        headers['X-Admin-Token'] = BENCH_ENV['ADMIN_TOKEN']
+    return {
+        'httpMethod': test.get('method', 'GET'),
+        'path': url.path or '/',
+        'queryStringParameters': dict(parse_qsl(url.query)),
+        'headers': headers,
+        'body': body if isinstance(body, str) or body is None else json.dumps(body),
+        'isBase64Encoded': False
+    }
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+def run_scenario(module: ModuleType, name: str, test: Dict[str, Any], concurrency: int, requests: int) -> Dict[str, Any]:
+    event = build_event(test)
+    expected_status = test.get('expectedStatus')
+
+    def invoke(_: int):
+        context = SimpleNamespace(request_id=uuid.uuid4().hex, function_name=name)
+        started = time.perf_counter()
+        try:
+            status = module.handler(dict(event), context).get('statusCode')
+        except Exception:
+            status = None
+        return (time.perf_counter() - started) * 1000, status
+
+    for i in range(min(concurrency, requests)):
+        invoke(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(invoke, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    mismatches = sum(1 for _, status in results if expected_status is not None and status != expected_status)
+    return {
+        'function': name,
+        'test': test.get('name', test.get('path', '/')),
+        'requests': requests,
+        'concurrency': concurrency,
+        'throughput': round(requests / wall, 1) if wall else 0.0,
+        'p50': round(percentile(latencies, 50), 2),
+        'p95': round(percentile(latencies, 95), 2),
+        'p99': round(percentile(latencies, 99), 2),
+        'max': round(latencies[-1], 2) if latencies else 0.0,
+        'status_mismatches': mismatches,
+        'budget': test.get('latencyBudgetMs') or {}
+    }
+
+def budget_violations(result: Dict[str, Any]) -> List[str]:
+    violations = []
+    for metric, limit in result['budget'].items():
+        if metric in result and result[metric] > limit:
+            violations.append(f"{metric} {result[metric]}ms > {limit}ms")
+    if result['status_mismatches']:
+        violations.append(f"{result['status_mismatches']} unexpected status codes")
+    return violations
+
+def apply_migrations(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.products') IS NOT NULL")
+        if cur.fetchone()[0]:
+            return
+        for migration in sorted(MIGRATIONS_DIR.glob('V*.sql')):
+            cur.execute(migration.read_text(encoding='utf-8'))
+    conn.commit()
+
+def seed_catalog(conn, size: int):
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE products RESTART IDENTITY CASCADE")
+        cur.execute(
+            """INSERT INTO products (name, category, price, image_url, glow_color, description, sku, created_at)
+               SELECT 'Светильник ' || (ARRAY['Nova', 'Aurora', 'Orbit', 'Luna', 'Prism'])[1 + g % 5] || ' ' || g,
+                      (ARRAY['interior', 'landscape'])[1 + g % 2],
+                      1000 + (g * 37) % 50000,
+                      'https://cdn.example.test/bucket/products/' || g || '.jpg',
+                      (ARRAY['blue', 'purple', 'orange'])[1 + g % 3],
+                      'Неоновый светильник для ' || (ARRAY['гостиной', 'сада', 'террасы', 'спальни'])[1 + g % 4],
+                      'BENCH-' || g,
+                      CURRENT_TIMESTAMP - g * INTERVAL '1 minute'
+               FROM generate_series(1, %s) AS g""",
+            (size,)
+        )
+        cur.execute(
+            """INSERT INTO site_settings (key, value)
+               VALUES ('store_name', '"Neon Bench"'), ('phone', '"+70000000000"')
+               ON CONFLICT (key) DO NOTHING"""
+        )
+    conn.commit()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("VACUUM ANALYZE products")
+    conn.autocommit = False
+
+def seed_bucket(s3, bucket: str, objects: int):
+    existing = [bucket_info['Name'] for bucket_info in s3.list_buckets().get('Buckets', [])]
+    if bucket not in existing:
+        s3.create_bucket(Bucket=bucket)
+    for i in range(objects):
+        s3.put_object(Bucket=bucket, Key=f'media/home/photo-{i:05d}.jpg', Body=b'\xff\xd8bench', ContentType='image/jpeg')
+        for width in (320, 640):
+            s3.put_object(
+                Bucket=bucket,
+                Key=f'media/home/_variants/photo-{i:05d}-{width}w.webp',
+                Body=b'RIFFbench',
+                ContentType='image/webp'
+            )
+
+def print_results(size: Optional[int], results: List[Dict[str, Any]]):
+    title = f'catalog size {size}' if size else 'no catalog'
+    print(f'\n== {title}')
+    print(f"{'function':<16} {'scenario':<40} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}  status")
+    for result in results:
+        violations = budget_violations(result)
+        print(
+            f"{result['function']:<16} {result['test'][:40]:<40} {result['throughput']:>9} "
+            f"{result['p50']:>9} {result['p95']:>9} {result['p99']:>9}  "
+            f"{'FAIL: ' + '; '.join(violations) if violations else 'ok'}"
+        )
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark backend handlers against tests.json scenarios')
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--sizes', default=DEFAULT_SIZES)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--functions', default=','.join(discover_functions()))
+    parser.add_argument('--s3-endpoint', default=os.environ.get('BENCH_S3_ENDPOINT'))
+    parser.add_argument('--media-objects', type=int, default=500)
+    parser.add_argument('--cold-cache', action='store_true')
+    parser.add_argument('--report')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    functions = [name.strip() for name in args.functions.split(',') if name.strip()]
+    needs_db = any(name in DB_FUNCTIONS for name in functions)
+    if needs_db and not args.database_url:
+        print('BENCH_DATABASE_URL or --database-url is required for database-backed functions', file=sys.stderr)
+        return 2
+
+    os.environ.update(BENCH_ENV)
+    if args.cold_cache:
+        os.environ.update(COLD_CACHE_ENV)
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+
+    with contextlib.ExitStack() as stack:
+        if any(name in S3_FUNCTIONS for name in functions):
+            import boto3
+            if args.s3_endpoint:
+                os.environ['S3_ENDPOINT_URL'] = args.s3_endpoint
+            else:
+                from moto import mock_aws
+                stack.enter_context(mock_aws())
+                os.environ['S3_ENDPOINT_URL'] = MOTO_ENDPOINT
+            seed_bucket(
+                boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL']),
+                os.environ['S3_BUCKET'],
+                args.media_objects
+            )
+
+        sizes: List[Optional[int]] = [int(size) for size in args.sizes.split(',') if size.strip()] if needs_db else [None]
+        report = []
+        failed = False
+        for size in sizes:
+            if size is not None:
+                import psycopg2
+                conn = psycopg2.connect(args.database_url)
+                try:
+                    apply_migrations(conn)
+                    seed_catalog(conn, size)
+                finally:
+                    conn.close()
+
+            results = []
+            for name in functions:
+                module = load_handler_module(name)
+                try:
+                    for test in load_scenarios(name):
+                        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                        with output:
+                            result = run_scenario(module, name, test, args.concurrency, args.requests)
+                        result['catalog_size'] = size
+                        result['violations'] = budget_violations(result)
+                        failed = failed or bool(result['violations'])
+                        results.append(result)
+                finally:
+                    close_handler_module(module)
+
+            print_results(size, results)
+            report.extend(results)
+
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
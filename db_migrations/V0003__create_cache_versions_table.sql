@@ -0,0 +1,20 @@
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO cache_versions (name) VALUES ('catalog') ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_cache_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE cache_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE name = TG_ARGV[0];
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_products_catalog_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+FOR EACH STATEMENT EXECUTE FUNCTION bump_cache_version('catalog');
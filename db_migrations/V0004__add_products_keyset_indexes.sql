@@ -0,0 +1,9 @@
+UPDATE products SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE products ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_products_created_id ON products(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_category_created_id ON products(category, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_price ON products(price);
+CREATE INDEX IF NOT EXISTS idx_products_glow_created_id ON products(glow_color, created_at DESC, id DESC);
+
+DROP INDEX IF EXISTS idx_products_category;
@@ -0,0 +1,25 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_text TEXT;
+
+CREATE OR REPLACE FUNCTION products_search_update() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+    NEW.search_text := lower(coalesce(NEW.name, '') || ' ' || coalesce(NEW.description, ''));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_products_search
+BEFORE INSERT OR UPDATE OF name, description ON products
+FOR EACH ROW EXECUTE FUNCTION products_search_update();
+
+UPDATE products SET name = name;
+
+CREATE INDEX IF NOT EXISTS idx_products_search_vector ON products USING GIN(search_vector);
+CREATE INDEX IF NOT EXISTS idx_products_search_text_trgm ON products USING GIN(search_text gin_trgm_ops);
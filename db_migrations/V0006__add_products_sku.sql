@@ -0,0 +1,3 @@
+ALTER TABLE products ADD COLUMN IF NOT EXISTS sku VARCHAR(100);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku);
@@ -0,0 +1,5 @@
+INSERT INTO cache_versions (name) VALUES ('settings') ON CONFLICT (name) DO NOTHING;
+
+CREATE TRIGGER trg_site_settings_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON site_settings
+FOR EACH STATEMENT EXECUTE FUNCTION bump_cache_version('settings');
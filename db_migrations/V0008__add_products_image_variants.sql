@@ -0,0 +1,2 @@
+ALTER TABLE products ADD COLUMN IF NOT EXISTS image_variants JSONB;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS image_placeholder TEXT;
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS telegram_updates (
+    id BIGSERIAL PRIMARY KEY,
+    update_id BIGINT,
+    payload JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processing', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+CREATE INDEX idx_telegram_updates_pending ON telegram_updates(run_after, id) WHERE status = 'pending';
+CREATE INDEX idx_telegram_updates_processing ON telegram_updates(locked_at) WHERE status = 'processing';
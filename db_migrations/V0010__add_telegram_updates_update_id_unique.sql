@@ -0,0 +1,5 @@
+DELETE FROM telegram_updates a
+USING telegram_updates b
+WHERE a.update_id = b.update_id AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_telegram_updates_update_id ON telegram_updates(update_id);
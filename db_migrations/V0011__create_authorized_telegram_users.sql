@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS authorized_telegram_users (
+    telegram_user_id BIGINT PRIMARY KEY,
+    phone_number VARCHAR(20) NOT NULL,
+    authorized_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO authorized_telegram_users (telegram_user_id, phone_number)
+SELECT DISTINCT telegram_user_id, phone_number
+FROM telegram_messages
+WHERE phone_number = '+79222142996'
+ON CONFLICT (telegram_user_id) DO NOTHING;
@@ -0,0 +1,13 @@
+ALTER TABLE telegram_updates ADD COLUMN IF NOT EXISTS media_group_id VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_updates_media_group ON telegram_updates(media_group_id) WHERE status = 'pending';
+
+CREATE TABLE IF NOT EXISTS product_images (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL DEFAULT 0,
+    image_url TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_product_images_product ON product_images(product_id, position);
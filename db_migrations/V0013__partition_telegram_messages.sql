@@ -0,0 +1,78 @@
+ALTER TABLE telegram_messages RENAME TO telegram_messages_legacy;
+ALTER INDEX telegram_messages_pkey RENAME TO telegram_messages_legacy_pkey;
+
+CREATE TABLE telegram_messages (
+    id INTEGER NOT NULL DEFAULT nextval('telegram_messages_id_seq'),
+    telegram_user_id BIGINT NOT NULL,
+    phone_number VARCHAR(20),
+    message_type VARCHAR(20) NOT NULL CHECK (message_type IN ('text', 'photo', 'video', 'document')),
+    message_text TEXT,
+    file_url TEXT,
+    file_id VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed BOOLEAN NOT NULL DEFAULT FALSE,
+    product_id INTEGER REFERENCES products(id),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE telegram_messages_default PARTITION OF telegram_messages DEFAULT;
+
+CREATE OR REPLACE FUNCTION create_telegram_messages_partition(month_start DATE) RETURNS VOID AS $$
+DECLARE
+    partition_name TEXT := format('telegram_messages_p%s', to_char(month_start, 'YYYYMM'));
+    month_end DATE := (month_start + INTERVAL '1 month')::date;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    CREATE TEMP TABLE telegram_messages_moved (LIKE telegram_messages) ON COMMIT DROP;
+    WITH moved AS (
+        DELETE FROM telegram_messages_default
+        WHERE created_at >= month_start AND created_at < month_end
+        RETURNING *
+    )
+    INSERT INTO telegram_messages_moved SELECT * FROM moved;
+
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF telegram_messages FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, month_end
+    );
+    INSERT INTO telegram_messages SELECT * FROM telegram_messages_moved;
+    DROP TABLE telegram_messages_moved;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_telegram_messages_partitions(months_ahead INTEGER) RETURNS VOID AS $$
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        PERFORM create_telegram_messages_partition((date_trunc('month', CURRENT_DATE) + make_interval(months => i))::date);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    legacy_month DATE;
+BEGIN
+    FOR legacy_month IN
+        SELECT DISTINCT date_trunc('month', created_at)::date FROM telegram_messages_legacy WHERE created_at IS NOT NULL
+    LOOP
+        PERFORM create_telegram_messages_partition(legacy_month);
+    END LOOP;
+    PERFORM ensure_telegram_messages_partitions(3);
+END $$;
+
+INSERT INTO telegram_messages
+    (id, telegram_user_id, phone_number, message_type, message_text, file_url, file_id, created_at, processed, product_id)
+SELECT id, telegram_user_id, phone_number, message_type, message_text, file_url, file_id,
+       COALESCE(created_at, CURRENT_TIMESTAMP), COALESCE(processed, FALSE), product_id
+FROM telegram_messages_legacy;
+
+ALTER SEQUENCE telegram_messages_id_seq OWNED BY telegram_messages.id;
+DROP TABLE telegram_messages_legacy;
+
+CREATE INDEX idx_telegram_messages_user ON telegram_messages(telegram_user_id);
+CREATE INDEX idx_telegram_messages_unprocessed ON telegram_messages(created_at) WHERE processed = FALSE;
+CREATE INDEX idx_telegram_messages_legacy_files ON telegram_messages(id)
+    WHERE file_url LIKE 'https://api.telegram.org/file/%' AND file_id IS NOT NULL;
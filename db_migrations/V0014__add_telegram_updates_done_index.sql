@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_telegram_updates_done ON telegram_updates(processed_at) WHERE status = 'done';
@@ -0,0 +1,3 @@
+UPDATE products
+SET image_variants = NULL, image_placeholder = NULL
+WHERE image_variants IS NOT NULL AND image_variants->>'source' IS DISTINCT FROM image_url;
@@ -0,0 +1,89 @@
+'''
+Business: Копирует общий рантайм из backend/_shared в index.py каждой облачной функции,
+          чтобы функции деплоились по отдельности, а код инструментирования и пула был один
+Args: --check - ничего не записывать, вернуть код 1, если какая-то копия разошлась с эталоном
+      --functions - список функций через запятую (по умолчанию все backend/*/index.py)
+Returns: список обновлённых (или разошедшихся при --check) функций
+'''
+
+import argparse
+import ast
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / 'backend'
+SHARED_DIR = BACKEND_DIR / '_shared'
+
+def discover_functions() -> List[str]:
+    return sorted(path.parent.name for path in BACKEND_DIR.glob('*/index.py'))
+
+def top_level_definitions(source: str) -> List[Tuple[str, int, int]]:
+    '''(имя, первая строка с декораторами, последняя строка) для def и class верхнего уровня'''
+    definitions = []
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            definitions.append((node.name, start, node.end_lineno))
+    return definitions
+
+def load_shared(path: Path) -> List[Tuple[str, str]]:
+    source = path.read_text(encoding='utf-8')
+    lines = source.splitlines()
+    return [(name, '\n'.join(lines[start - 1:end])) for name, start, end in top_level_definitions(source)]
+
+def render(text: str, pep8_spacing: bool) -> str:
+    '''Эталон хранит пустые строки внутри функций с отступом; в файлах с двумя пустыми строками между def - без него'''
+    if not pep8_spacing:
+        return text
+    return '\n'.join(line if line.strip() else '' for line in text.splitlines())
+
+def apply_shared(source: str, shared: List[Tuple[str, str]], label: str) -> Optional[str]:
+    '''Возвращает index.py с подставленным эталоном или None, если функция не использует этот блок'''
+    definitions = {name: (start, end) for name, start, end in top_level_definitions(source)}
+    if shared[0][0] not in definitions:
+        return None
+    missing = [name for name, _ in shared if name not in definitions]
+    if missing:
+        raise SystemExit(f'{label}: missing shared definitions {", ".join(missing)}')
+    lines = source.splitlines(keepends=True)
+    pep8_spacing = '\n\n\ndef ' in source
+    for name, text in sorted(shared, key=lambda item: -definitions[item[0]][0]):
+        start, end = definitions[name]
+        lines[start - 1:end] = [render(text, pep8_spacing) + '\n']
+    return ''.join(lines)
+
+def sync_function(name: str, shared_files: List[Path], check: bool) -> List[str]:
+    index_path = BACKEND_DIR / name / 'index.py'
+    source = index_path.read_text(encoding='utf-8')
+    updated = source
+    changed = []
+    for shared_path in shared_files:
+        result = apply_shared(updated, load_shared(shared_path), f'{name}/index.py')
+        if result is not None and result != updated:
+            changed.append(shared_path.stem)
+            updated = result
+    if changed and not check:
+        index_path.write_text(updated, encoding='utf-8')
+    return changed
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Copy backend/_shared runtime into every function')
+    parser.add_argument('--check', action='store_true')
+    parser.add_argument('--functions', default=','.join(discover_functions()))
+    return parser.parse_args(argv)
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    shared_files = sorted(SHARED_DIR.glob('*.py'))
+    drifted = False
+    for name in [name.strip() for name in args.functions.split(',') if name.strip()]:
+        changed = sync_function(name, shared_files, args.check)
+        if changed:
+            drifted = True
+            print(f"{name}: {'differs from' if args.check else 'updated from'} {', '.join(changed)}")
+    return 1 if args.check and drifted else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
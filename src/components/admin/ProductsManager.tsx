@@ -6,7 +6,7 @@ import { Label } from "@/components/ui/label";
 import { Textarea } from "@/components/ui/textarea";
 import Icon from "@/components/ui/icon";
 import { useToast } from "@/hooks/use-toast";
-import { API_ENDPOINTS, apiRequest } from "@/config/api";
+import { API_ENDPOINTS, apiRequest, getReadOptions } from "@/config/api";
 import {
   Dialog,
   DialogContent,
@@ -72,7 +72,7 @@ export default function ProductsManager() {
   const loadProducts = async () => {
     try {
       setLoading(true);
-      const response = await fetch(API_ENDPOINTS.products);
+      const response = await fetch(API_ENDPOINTS.products, getReadOptions());
       const data = await response.json();
       setProducts(data.products || []);
     } catch (error) {
@@ -99,26 +99,35 @@ export default function ProductsManager() {
         description: formData.description,
       };
 
+      let savedId: number | undefined;
       if (editingProduct) {
         await apiRequest(`${API_ENDPOINTS.adminProducts}?id=${editingProduct.id}`, {
           method: 'PUT',
           body: JSON.stringify(productData),
         });
+        savedId = editingProduct.id;
         toast({
           title: "✅ Обновлено",
           description: "Товар успешно обновлён",
         });
       } else {
-        await apiRequest(API_ENDPOINTS.adminProducts, {
+        const created = await apiRequest(API_ENDPOINTS.adminProducts, {
           method: 'POST',
           body: JSON.stringify(productData),
         });
+        savedId = created.product_id;
         toast({
           title: "✅ Добавлено",
           description: "Товар успешно добавлен",
         });
       }
 
+      if (savedId) {
+        apiRequest(`${API_ENDPOINTS.adminProducts}?action=derive-images&force=0&id=${savedId}`, {
+          method: 'POST',
+        }).catch(() => undefined);
+      }
+
       setIsDialogOpen(false);
       resetForm();
       loadProducts();
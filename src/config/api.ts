@@ -8,13 +8,30 @@ export const API_ENDPOINTS = {
   mediaList: 'https://functions.poehali.dev/203e8a90-6806-4b92-a247-9d276bf780e6'
 };
 
+const LAST_WRITE_KEY = 'lastWrite';
+const LAST_WRITE_SEEN_KEY = 'lastWriteSeenAt';
+const READ_YOUR_WRITES_WINDOW_MS = 15000;
+
+const hasRecentWrite = () =>
+  Date.now() - Number(sessionStorage.getItem(LAST_WRITE_SEEN_KEY) || 0) < READ_YOUR_WRITES_WINDOW_MS;
+
+export const getReadHeaders = (): Record<string, string> => {
+  const lastWrite = sessionStorage.getItem(LAST_WRITE_KEY);
+  return lastWrite && hasRecentWrite() ? { 'X-Last-Write': lastWrite } : {};
+};
+
+export const getReadOptions = (): RequestInit =>
+  hasRecentWrite() ? { headers: getReadHeaders(), cache: 'no-store' } : {};
+
 export const getAuthHeaders = () => ({
   'Content-Type': 'application/json',
-  'X-Admin-Token': ADMIN_TOKEN
+  'X-Admin-Token': ADMIN_TOKEN,
+  ...getReadHeaders()
 });
 
 export const apiRequest = async (url: string, options: RequestInit = {}) => {
   const response = await fetch(url, {
+    ...(hasRecentWrite() ? { cache: 'no-store' as RequestCache } : {}),
     ...options,
     headers: {
       ...getAuthHeaders(),
@@ -27,5 +44,11 @@ export const apiRequest = async (url: string, options: RequestInit = {}) => {
     throw new Error(error.error || error.message || 'API request failed');
   }
   
+  const lastWrite = response.headers.get('X-Last-Write');
+  if (lastWrite) {
+    sessionStorage.setItem(LAST_WRITE_KEY, lastWrite);
+    sessionStorage.setItem(LAST_WRITE_SEEN_KEY, String(Date.now()));
+  }
+  
   return response.json();
 };
\ No newline at end of file